@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark real time factor and quality of trained Multi-Singer generators."""
+
+import argparse
+import logging
+import os
+import time
+
+import torch
+import yaml
+
+from losses import MultiResolutionSTFTLoss
+from utils import find_files
+from utils import load_model
+from utils import read_hdf5
+from utils import simple_table
+
+
+def benchmark(model, items, criterion, sampling_rate, references=None):
+    """Measure real time factor and STFT distances of the generator.
+
+    Args:
+        model (torch.nn.Module): Generator with weight norm removed.
+        items (list): List of tuples of features (T', C), natural waveform (T,) and noise (T, 1).
+        criterion (MultiResolutionSTFTLoss): STFT distance.
+        sampling_rate (int): Sampling rate.
+        references (list): List of reference waveforms (T,) to be compared with.
+
+    Returns:
+        dict: Averaged real time factor and STFT distances.
+        list: List of generated waveforms (T,).
+
+    """
+    results = {"rtf": 0.0, "sc": 0.0, "mag": 0.0, "ref_sc": 0.0, "ref_mag": 0.0}
+    ys = []
+    with torch.no_grad():
+        # warm up
+        model.inference(items[0][0], items[0][2])
+        for i, (c, y, x) in enumerate(items):
+            start = time.time()
+            y_ = model.inference(c, x).view(-1)
+            results["rtf"] += (time.time() - start) / (len(y_) / sampling_rate)
+            length = min(len(y), len(y_))
+            sc_loss, mag_loss = criterion(y_[:length].unsqueeze(0), y[:length].unsqueeze(0))
+            results["sc"] += sc_loss.item()
+            results["mag"] += mag_loss.item()
+            if references is not None:
+                sc_loss, mag_loss = criterion(y_.unsqueeze(0), references[i].unsqueeze(0))
+                results["ref_sc"] += sc_loss.item()
+                results["ref_mag"] += mag_loss.item()
+            ys.append(y_)
+    return {key: value / len(items) for key, value in results.items()}, ys
+
+
+def main():
+    """Run benchmark process."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark real time factor against quality of trained Multi-Singer generators.")
+    parser.add_argument("--inputdir", '-i', type=str, required=True,
+                        help="directory including dumped hdf5 files with mel and wav.")
+    parser.add_argument("--checkpoints", '-c', type=str, nargs="+", required=True,
+                        help="checkpoint files to be compared. "
+                             "the first one is used as the reference (e.g. the teacher).")
+    parser.add_argument("--configs", '-g', type=str, nargs="*", default=None,
+                        help="yaml format configuration files of the checkpoints. if not explicitly "
+                             "provided, they will be searched in the checkpoint directories. (default=None)")
+    parser.add_argument("--num_utterances", default=10, type=int,
+                        help="number of utterances used for the benchmark. (default=10)")
+    parser.add_argument("--num_threads", default=1, type=int,
+                        help="number of cpu threads. (default=1)")
+    parser.add_argument("--seed", default=1, type=int,
+                        help="seed of the input noise. (default=1)")
+    parser.add_argument("--verbose", type=int, default=1,
+                        help="logging level. higher is more logging. (default=1)")
+    args = parser.parse_args()
+
+    # set logger
+    if args.verbose > 1:
+        logging.basicConfig(
+            level=logging.DEBUG, format="%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s")
+    elif args.verbose > 0:
+        logging.basicConfig(
+            level=logging.INFO, format="%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s")
+    else:
+        logging.basicConfig(
+            level=logging.WARN, format="%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s")
+        logging.warning("Skip DEBUG/INFO messages")
+
+    # check arguments
+    if args.configs is not None and len(args.configs) != len(args.checkpoints):
+        raise ValueError("--configs must be given for each of --checkpoints.")
+    torch.set_num_threads(args.num_threads)
+
+    # load configs
+    configs = []
+    for i, checkpoint in enumerate(args.checkpoints):
+        config_path = args.configs[i] if args.configs is not None else \
+            os.path.join(os.path.dirname(checkpoint), "config.yml")
+        with open(config_path) as f:
+            configs.append(yaml.load(f, Loader=yaml.Loader))
+    sampling_rate = configs[0]["sampling_rate"]
+    criterion = MultiResolutionSTFTLoss(**configs[0]["stft_loss_params"])
+
+    # load features, natural waveforms and fixed noise
+    files = sorted(find_files(args.inputdir, "*.h5"))[:args.num_utterances]
+    assert len(files) != 0, f"Not found any hdf5 files in {args.inputdir}."
+    hop_size = configs[0]["hop_size"]
+    generator = torch.Generator().manual_seed(args.seed)
+    items = []
+    for filename in files:
+        c = torch.tensor(read_hdf5(filename, "mel"), dtype=torch.float)
+        y = torch.tensor(read_hdf5(filename, "wav"), dtype=torch.float)
+        x = torch.randn(len(c) * hop_size, 1, generator=generator)
+        items.append((c, y, x))
+    logging.info(f"Benchmark with {len(items)} utterances on {args.num_threads} cpu thread(s).")
+
+    # run benchmark
+    references = None
+    for checkpoint, config in zip(args.checkpoints, configs):
+        model = load_model(checkpoint, config)
+        model.remove_weight_norm()
+        model = model.eval()
+        results, ys = benchmark(model, items, criterion, sampling_rate, references)
+        num_params = sum([p.numel() for p in model.parameters()]) / 1e6
+        table = [
+            ("Checkpoint", checkpoint),
+            ("Params [M]", f"{num_params:.2f}"),
+            ("RTF", f"{results['rtf']:.4f}"),
+            ("Spectral convergence", f"{results['sc']:.4f}"),
+            ("Log STFT magnitude", f"{results['mag']:.4f}"),
+        ]
+        if references is None:
+            references = ys
+        else:
+            table += [
+                ("Spectral convergence (ref)", f"{results['ref_sc']:.4f}"),
+                ("Log STFT magnitude (ref)", f"{results['ref_mag']:.4f}"),
+            ]
+        simple_table(table)
+
+
+if __name__ == "__main__":
+    main()
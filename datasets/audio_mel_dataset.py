@@ -15,6 +15,7 @@ import numpy as np
 from torch.utils.data import Dataset
 
 from utils import find_files
+from utils import get_singer_id
 from utils import read_hdf5
 
 
@@ -31,7 +32,9 @@ class AudioMelEmbedDataset(Dataset):  #读取audio与mel h5数据集
                  use_chroma=False,
                  use_utt_id=False,
                  allow_cache=False,
-                 eval=False
+                 eval=False,
+                 singer_registry=None,
+                 singer_delimiter="_",
                  ):
         """Initialize dataset.
 
@@ -45,6 +48,9 @@ class AudioMelEmbedDataset(Dataset):  #读取audio与mel h5数据集
             mel_length_threshold (int): Threshold to remove short feature files.
             return_utt_id (bool): Whether to return the utterance id with arrays.
             allow_cache (bool): Whether to allow cache of the loaded files.
+            singer_registry (SingerEmbeddingRegistry): Registry of singer embeddings. If provided,
+                the centroid embedding of the singer is used instead of the utterance embedding.
+            singer_delimiter (str): Delimiter between the singer id and the rest of the utterance id.
 
         """
         # find all of audio and mel files
@@ -93,6 +99,8 @@ class AudioMelEmbedDataset(Dataset):  #读取audio与mel h5数据集
         self.use_chroma = use_chroma
         self.use_utt_id = use_utt_id
         self.allow_cache = allow_cache
+        self.singer_registry = singer_registry
+        self.singer_delimiter = singer_delimiter
 
         if use_f0:
             self.f0_origin_load_fn = lambda x: read_hdf5(x, "f0_origin")
@@ -125,7 +133,10 @@ class AudioMelEmbedDataset(Dataset):  #读取audio与mel h5数据集
 
         audio = self.audio_load_fn(self.files[idx])
         feat = self.feat_load_fn(self.files[idx])
-        embed = self.embed_load_fn(self.files[idx])
+        if self.singer_registry is not None:
+            embed = self.singer_registry.get(get_singer_id(self.utt_ids[idx], self.singer_delimiter))
+        else:
+            embed = self.embed_load_fn(self.files[idx])
         items = {'audio':audio, 'feat':feat, 'embed':embed}
 
         if self.use_utt_id:
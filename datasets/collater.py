@@ -114,7 +114,8 @@ class Embeds_Collater(object):
                  aux_context_window=2,
                  use_noise_input=False,
                  use_f0=False,
-                 use_chroma=False
+                 use_chroma=False,
+                 crop_step=1,
                  ):
         """Initialize customized collater for PyTorch DataLoader.
 
@@ -123,6 +124,8 @@ class Embeds_Collater(object):
             hop_size (int): Hop size of auxiliary features.
             aux_context_window (int): Context window size for auxiliary feature conv.
             use_noise_input (bool): Whether to use noise input.
+            crop_step (int): Step of the start frames of the random crops. Larger values
+                make the same crops recur more often.
 
         """
         if batch_max_steps % hop_size != 0:
@@ -136,6 +139,7 @@ class Embeds_Collater(object):
         self.use_noise_input = use_noise_input
         self.use_f0 = use_f0
         self.use_chroma = use_chroma
+        self.crop_step = crop_step
 
         # set useful values in random cutting  随机截取长度
         self.start_offset = aux_context_window  # 开始偏移位置 = 窗大小
@@ -150,8 +154,8 @@ class Embeds_Collater(object):
 
         # make batch with random cut  随机裁剪窗
         c_lengths = [len(c) for c in cs]
-        start_frames = np.array([np.random.randint(
-            self.start_offset, cl + self.end_offset) for cl in c_lengths])
+        start_frames = np.array([self.start_offset + self.crop_step * np.random.randint(
+            0, (cl + self.end_offset - self.start_offset - 1) // self.crop_step + 1) for cl in c_lengths])
         x_starts = start_frames * self.hop_size                                   # audio 起始
         x_ends = x_starts + self.batch_max_steps                                  # audio 结束
         c_starts = start_frames - self.aux_context_window                         # mel 起始
@@ -165,6 +169,9 @@ class Embeds_Collater(object):
         embed_batch = torch.tensor(embed, dtype=torch.float).unsqueeze(-1)  # (B, 128) -> (B, 128, 1)
 
         batchs = {'audios': y_batch, 'feats': c_batch, 'embed': embed_batch}  ###################    得到 batch["audio"] 与 batch["feats"]   ###################
+        batchs['start_frames'] = torch.tensor(start_frames, dtype=torch.long)
+        if 'utt_id' in batch[0]:
+            batchs['utt_ids'] = [b['utt_id'] for b in batch]
 
         if self.use_f0:
             # f0s = [b['f0'] for b in batch if 'f0' in b]
@@ -58,6 +58,18 @@ def preprocess_wav_torch(wav, source_sr=None):
     wav = normalize_volume_torch(wav, audio_norm_target_dBFS, increase_only=True)
     return wav
 
+def preprocess_wavs_torch(wavs):
+    """
+    Applies the volume normalization of preprocess_wav_torch to a batch of waveforms at once.
+
+    :param wavs: waveforms as a Tensor of shape (batch_size, n_samples)
+    :return: the normalized waveforms as a Tensor of shape (batch_size, n_samples)
+    """
+    dBFS_change = audio_norm_target_dBFS - 10 * torch.log10(torch.mean(wavs ** 2, dim=-1, keepdim=True))
+    # increase only
+    scale = torch.where(dBFS_change < 0, torch.ones_like(dBFS_change), 10 ** (dBFS_change / 20))
+    return wavs * scale
+
 def wav_to_mel_spectrogram(wav):
     """
     Derives a mel spectrogram ready to be used by the encoder from a preprocessed audio waveform.
@@ -117,11 +129,34 @@ def wav_to_mel_spectrogram_torch(wav):
         n_mels=mel_n_channels,
         n_fft=n_fft,
         power=2.0,
-    ).cuda()
+    ).to(wav.device)
     frames = MelSpectrogram(wav.float())
     return frames.T
 
 
+_mel_spectrograms = {}
+
+def wavs_to_mel_spectrogram_torch(wavs):
+    """
+    Derives mel spectrograms of a batch of preprocessed waveforms at once. The transform is
+    built once for each device and reused.
+    Note: this not a log-mel spectrogram.
+    wavs: Tensor (B, T)
+    return: Tensor (B, T', n_mels)
+    """
+    if wavs.device not in _mel_spectrograms:
+        _mel_spectrograms[wavs.device] = torchaudio.transforms.MelSpectrogram(
+            sample_rate=sampling_rate,
+            win_length=win_length,
+            hop_length=hop_length,
+            n_mels=mel_n_channels,
+            n_fft=n_fft,
+            power=2.0,
+        ).to(wavs.device)
+    frames = _mel_spectrograms[wavs.device](wavs.float())
+    return frames.transpose(1, 2)
+
+
 def trim_long_silences(wav):
     """
     Ensures that segments without voice in the waveform remain no longer than a 
@@ -1,6 +1,7 @@
 from encoder.params_data import *
 from encoder.model import SpeakerEncoder
 from encoder.audio import preprocess_wav_torch   # We want to expose this function from here
+from encoder.audio import preprocess_wavs_torch
 from matplotlib import cm
 from encoder import audio
 from pathlib import Path
@@ -32,10 +33,14 @@ def load_model(weights_fpath: Path, device=None, preprocess=False, rank=0):
         _device = torch.device(device)
     # _model = SpeakerEncoder(_device, _device).to(device)
     _model = SpeakerEncoder(_device, torch.device("cpu"))
-    checkpoint = torch.load(weights_fpath)
+    checkpoint = torch.load(weights_fpath, map_location="cpu")
     _model.load_state_dict(checkpoint["model_state"])
 
-    if not preprocess:  _model.cuda()
+    # the model runs on the given device, or on the gpu of this process if available
+    if not preprocess:
+        if device is None:
+            device = torch.device("cuda", rank) if torch.cuda.is_available() else torch.device("cpu")
+        _model.to(device)
 
     print("Loaded encoder \"%s\" trained to step %d" % (weights_fpath, checkpoint["step"]))
     
@@ -244,6 +249,34 @@ def embed_utterance_torch(wav, using_partials=True, return_partials=False, **kwa
 
 
 
+def embed_utterances_torch(wavs, **kwargs):
+    """
+    Computes the embeddings of a batch of utterances of the same length at once, which are the
+    same as the ones of embed_utterance_torch for each utterance. The partial utterances of all
+    the utterances are embedded with a single forward pass of the model.
+
+    :param wavs: preprocessed (see audio.py) utterance waveforms as a Tensor of shape
+    (batch_size, n_samples)
+    :param kwargs: additional arguments to compute_partial_splits()
+    :return: the embeddings as a Tensor of shape (batch_size, model_embedding_size)
+    """
+    # Compute where to split the utterances into partials and pad if necessary
+    wave_slices, mel_slices = compute_partial_slices(wavs.size(-1), **kwargs)
+    max_wave_length = wave_slices[-1].stop
+    if max_wave_length >= wavs.size(-1):
+        wavs = torch.nn.functional.pad(wavs, (0, max_wave_length - wavs.size(-1)), "constant")
+
+    # Split the utterances into partials
+    frames = audio.wavs_to_mel_spectrogram_torch(wavs) # (batch, T, n_mels)
+    frames_batch = torch.stack([frames[:, s] for s in mel_slices], dim=1) # (batch, partials, short T, n_mels)
+    partial_embeds = embed_frames_batch_torch(frames_batch.flatten(0, 1)) # (batch * partials, n_embeddings(256))
+    partial_embeds = partial_embeds.view(len(wavs), len(mel_slices), -1)
+
+    # Compute the utterance embeddings from the partial embeddings
+    raw_embeds = torch.mean(partial_embeds, dim=1) # (batch, n_embeddings(256))
+    return raw_embeds / torch.norm(raw_embeds, 2, dim=1, keepdim=True)
+
+
 def embed_utterance_torch_perceptual(wav, using_partials=True, return_partials=False, **kwargs):
     """
     Computes an embedding for a single utterance.
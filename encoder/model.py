@@ -28,7 +28,7 @@ class SpeakerEncoder(nn.Module):
         self.similarity_bias = nn.Parameter(torch.tensor([-5.])).to(loss_device)
 
         # Loss
-        self.loss_fn = nn.CrossEntropyLoss().cuda()
+        self.loss_fn = nn.CrossEntropyLoss().to(loss_device)
         
     def do_gradient_ops(self):
         # Gradient scale
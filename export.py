@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Export trained Multi-Singer Generator for deployment."""
+
+import argparse
+import json
+import logging
+import os
+import time
+
+import torch
+import yaml
+
+from utils import load_model
+from utils import shrink_residual_blocks
+
+
+class InferenceWrapper(torch.nn.Module):
+    """Wrapper of the generator with the inference pre/post-processing."""
+
+    def __init__(self, model):
+        """Initialize inference wrapper.
+
+        Args:
+            model (torch.nn.Module): Generator with weight norm removed.
+
+        """
+        super(InferenceWrapper, self).__init__()
+        self.model = model
+        self.pad = torch.nn.ReplicationPad1d(model.aux_context_window)
+
+    def forward(self, c, x):
+        """Calculate forward propagation.
+
+        Args:
+            c (Tensor): Local conditioning auxiliary features (T', C).
+            x (Tensor): Input noise signal (T, 1).
+
+        Returns:
+            Tensor: Output tensor (T, out_channels).
+
+        """
+        c = self.pad(c.transpose(1, 0).unsqueeze(0))
+        x = x.transpose(1, 0).unsqueeze(0)
+        return self.model(x, c).squeeze(0).transpose(1, 0)
+
+
+def export_torchscript(wrapper, example_inputs, path, extra_files):
+    """Export the generator as a traced TorchScript module.
+
+    Args:
+        wrapper (InferenceWrapper): Generator wrapper to be exported.
+        example_inputs (tuple): Example features and noise used for tracing.
+        path (str): Output filename.
+        extra_files (dict): Extra files stored together with the module.
+
+    """
+    traced = torch.jit.trace(wrapper, example_inputs, check_trace=False)
+    torch.jit.save(traced, path, _extra_files=extra_files)
+
+
+def export_onnx(wrapper, example_inputs, path, metadata, opset_version=13):
+    """Export the generator as an ONNX model with dynamic time axes.
+
+    Args:
+        wrapper (InferenceWrapper): Generator wrapper to be exported.
+        example_inputs (tuple): Example features and noise used for tracing.
+        path (str): Output filename.
+        metadata (dict): Metadata stored in the model.
+        opset_version (int): ONNX opset version.
+
+    """
+    try:
+        import onnx
+    except ImportError:
+        raise ImportError("onnx is not installed. please check https://github.com/onnx/onnx.")
+    torch.onnx.export(
+        wrapper, example_inputs, path,
+        input_names=["c", "x"],
+        output_names=["y"],
+        dynamic_axes={"c": {0: "frames"}, "x": {0: "samples"}, "y": {0: "samples"}},
+        opset_version=opset_version,
+    )
+
+    # keep the inference information in the model itself
+    model = onnx.load(path)
+    for key, value in metadata.items():
+        meta = model.metadata_props.add()
+        meta.key, meta.value = key, value
+    onnx.checker.check_model(model)
+    onnx.save(model, path)
+
+
+def check_parity(wrapper, path, format, hop_size, frames=200):
+    """Compare the outputs of the exported model and the eager model.
+
+    The number of frames is chosen differently from the example input
+    to check that the time axis of the exported model is dynamic.
+
+    Args:
+        wrapper (InferenceWrapper): Eager generator wrapper.
+        path (str): Filename of the exported model.
+        format (str): Format of the exported model.
+        hop_size (int): Number of samples per frame.
+        frames (int): Number of frames of the input used for the check.
+
+    Returns:
+        float: Maximum absolute difference of the outputs.
+
+    """
+    c = torch.randn(frames, wrapper.model.aux_channels)
+    x = torch.randn(frames * hop_size, 1)
+    with torch.no_grad():
+        y = wrapper(c, x).numpy()
+        if format == "torchscript":
+            y_ = torch.jit.load(path)(c, x).numpy()
+        else:
+            import onnxruntime
+
+            session = onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"])
+            y_ = session.run(["y"], {"c": c.numpy(), "x": x.numpy()})[0]
+    assert y.shape == y_.shape, f"Output shape mismatch ({y.shape} vs {y_.shape})."
+    return float(abs(y - y_).max())
+
+
+def measure_rtf(wrapper, hop_size, sampling_rate, frames=200, repeats=3):
+    """Measure real time factor of the generator on random features.
+
+    Args:
+        wrapper (InferenceWrapper): Eager generator wrapper.
+        hop_size (int): Number of samples per frame.
+        sampling_rate (int): Sampling rate.
+        frames (int): Number of frames of the input.
+        repeats (int): Number of measurements to be averaged.
+
+    Returns:
+        float: Real time factor.
+
+    """
+    c = torch.randn(frames, wrapper.model.aux_channels)
+    x = torch.randn(frames * hop_size, 1)
+    with torch.no_grad():
+        # warm up
+        wrapper(c, x)
+        start = time.time()
+        for _ in range(repeats):
+            wrapper(c, x)
+    return (time.time() - start) / repeats / (frames * hop_size / sampling_rate)
+
+
+def main():
+    """Run export process."""
+    parser = argparse.ArgumentParser(
+        description="Export trained Multi-Singer Generator with weight norm folded.")
+    parser.add_argument("--checkpoint", '-c', type=str, required=True,
+                        help="checkpoint file to be loaded.")
+    parser.add_argument("--config", '-g', default=None, type=str,
+                        help="yaml format configuration file. if not explicitly provided, "
+                             "it will be searched in the checkpoint directory. (default=None)")
+    parser.add_argument("--outfile", '-o', type=str, required=True,
+                        help="filename of the exported model.")
+    parser.add_argument("--format", default="torchscript", type=str,
+                        choices=["torchscript", "onnx", "pytorch"],
+                        help="format of the exported model. pytorch saves a checkpoint and config.yml "
+                             "which can be loaded by load_model. (default=torchscript)")
+    parser.add_argument("--prune", default=False, action="store_true",
+                        help="whether to remove the gate channels pruned during training "
+                             "from the conv weights.")
+    parser.add_argument("--example_frames", default=100, type=int,
+                        help="number of frames of the example input used for tracing. (default=100)")
+    parser.add_argument("--opset_version", default=13, type=int,
+                        help="opset version of the exported onnx model. (default=13)")
+    parser.add_argument("--check", default=False, action="store_true",
+                        help="whether to compare the exported model with the eager model.")
+    parser.add_argument("--tolerance", default=1e-4, type=float,
+                        help="maximum absolute difference allowed in the check. (default=1e-4)")
+    parser.add_argument("--verbose", type=int, default=1,
+                        help="logging level. higher is more logging. (default=1)")
+    args = parser.parse_args()
+
+    # set logger
+    if args.verbose > 1:
+        logging.basicConfig(
+            level=logging.DEBUG, format="%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s")
+    elif args.verbose > 0:
+        logging.basicConfig(
+            level=logging.INFO, format="%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s")
+    else:
+        logging.basicConfig(
+            level=logging.WARN, format="%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s")
+        logging.warning("Skip DEBUG/INFO messages")
+
+    # load config
+    if args.config is None:
+        dirname = os.path.dirname(args.checkpoint)
+        args.config = os.path.join(dirname, "config.yml")
+    with open(args.config) as f:
+        config = yaml.load(f, Loader=yaml.Loader)
+
+    # setup model on cpu with weight norm folded into the conv weights
+    model = load_model(args.checkpoint, config)
+    logging.info(f"Loaded model parameters from {args.checkpoint}.")
+    model.remove_weight_norm()
+    model = model.eval()
+    wrapper = InferenceWrapper(model).eval()
+
+    # information needed to run the exported model without the config file
+    hop_size = int(model.upsample_factor * model.pqmf.subbands)
+
+    # physically remove the pruned gate channels
+    if args.prune:
+        state_dict = torch.load(args.checkpoint, map_location="cpu")
+        if "pruning" not in state_dict:
+            raise ValueError(f"{args.checkpoint} does not have the gate masks of pruning.")
+        for f, mask in zip(model.conv_layers, state_dict["pruning"]["gate_masks"]):
+            f.gate_mask = mask
+        rtf = measure_rtf(wrapper, hop_size, config["sampling_rate"])
+        logging.info(f"RTF before shrinking = {rtf:.4f}.")
+        gate_channels = shrink_residual_blocks(model.conv_layers)
+        config["generator_params"]["gate_channels"] = gate_channels
+        rtf = measure_rtf(wrapper, hop_size, config["sampling_rate"])
+        logging.info(f"RTF after shrinking = {rtf:.4f}.")
+        for layer, channels in enumerate(gate_channels):
+            logging.info(f"Layer {layer}: {channels // 2} gate channels.")
+    exported_config = {
+        "sampling_rate": config["sampling_rate"],
+        "hop_size": hop_size,
+        "format": config["format"],
+        "num_mels": model.aux_channels,
+    }
+
+    c = torch.randn(args.example_frames, model.aux_channels)
+    x = torch.randn(args.example_frames * hop_size, 1)
+    outdir = os.path.dirname(args.outfile)
+    if len(outdir) != 0 and not os.path.exists(outdir):
+        os.makedirs(outdir)
+    with torch.no_grad():
+        if args.format == "pytorch":
+            # weights are saved with weight norm folded
+            config["generator_params"]["use_weight_norm"] = False
+            torch.save({"model": {"generator": model.state_dict()}}, args.outfile)
+            # named after the outfile not to overwrite the config of the other checkpoints
+            config_path = os.path.splitext(args.outfile)[0] + ".yml"
+            with open(config_path, "w") as f:
+                yaml.dump(config, f, Dumper=yaml.Dumper)
+            logging.info(f"Saved config of the exported model to {config_path}.")
+        elif args.format == "torchscript":
+            export_torchscript(wrapper, (c, x), args.outfile,
+                               {"config.json": json.dumps(exported_config)})
+        else:
+            export_onnx(wrapper, (c, x), args.outfile,
+                        {"config.json": json.dumps(exported_config)},
+                        opset_version=args.opset_version)
+    logging.info(f"Successfully exported {args.format} model to {args.outfile}.")
+
+    # check the exported model
+    if args.check and args.format != "pytorch":
+        diff = check_parity(wrapper, args.outfile, args.format, hop_size,
+                            frames=2 * args.example_frames)
+        logging.info(f"Maximum absolute difference from the eager model = {diff:.3e}.")
+        if diff > args.tolerance:
+            raise ValueError(f"Exported model differs from the eager model ({diff:.3e} > {args.tolerance}).")
+
+
+if __name__ == "__main__":
+    main()
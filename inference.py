@@ -4,49 +4,292 @@
 """Decode with trained Multi-Singer."""
 
 import argparse
+import copy
+import functools
+import glob
+import json
 import logging
 import os
+import queue
+import threading
 import time
+import traceback
+
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import soundfile as sf
 import torch
-import yaml
 
+from torch.utils.data import DataLoader
 from tqdm import tqdm
 
 from datasets import MelDataset
-from utils import load_model
+from utils import get_checkpoint_id
+from utils import InferenceCache
+from utils import NoiseProvider
+from utils import plan_chunks
+from utils import quantize_generator
 from utils import read_hdf5
-import os
 
-def main():
-    """Run decoding process."""
-    parser = argparse.ArgumentParser(
-        description="Decode dumped features with trained Parallel WaveGAN Generator "
-                    "(See detail in parallel_wavegan/bin/decode.py).")
-    parser.add_argument("--inputdir",'-i', type=str,required=True,
-                        help="directory including feature files. "
-                             "you need to specify either feats-scp or inputdir.")
-    parser.add_argument("--outdir",'-o',type=str, required=True,
-                        help="directory to save generated speech.")
-    parser.add_argument("--checkpoint",'-c',type=str, required=True,
-                        help="checkpoint file to be loaded.")
-    parser.add_argument("--config", '-g',default=None, type=str,
-                        help="yaml format configuration file. if not explicitly provided, "
-                             "it will be searched in the checkpoint directory. (default=None)")
-    parser.add_argument("--verbose", type=int, default=1,
-                        help="logging level. higher is more logging. (default=1)")
-    parser.add_argument("--rank", default=0, type=int,
-                        help="rank for distributed training. no need to explictly specify.")
-    parser.add_argument("--force_cpu", type=bool, default=False)
-    args = parser.parse_args()
 
-    # set logger
-    if args.verbose > 1:
+class TorchScriptGenerator(object):
+    """Generator exported as a TorchScript module with export.py."""
+
+    def __init__(self, checkpoint, device=torch.device("cpu")):
+        """Load exported generator.
+
+        Args:
+            checkpoint (str): Filename of the exported module.
+            device (torch.device): Pytorch device instance.
+
+        """
+        extra_files = {"config.json": ""}
+        self.module = torch.jit.load(checkpoint, map_location=device, _extra_files=extra_files)
+        self.config = json.loads(extra_files["config.json"])
+        self.device = device
+
+    def inference(self, c, x=None):
+        """Perform inference.
+
+        Args:
+            c (Tensor): Local conditioning auxiliary features (T' ,C).
+            x (Tensor): Input noise signal (T, 1).
+
+        Returns:
+            Tensor: Output tensor (T, out_channels)
+
+        """
+        if x is None:
+            x = torch.randn(len(c) * self.config["hop_size"], 1).to(self.device)
+        return self.module(c, x)
+
+
+class OnnxRuntimeGenerator(object):
+    """Generator exported as an ONNX model with export.py and run by ONNX Runtime."""
+
+    def __init__(self, checkpoint, num_threads=0):
+        """Load exported generator.
+
+        Args:
+            checkpoint (str): Filename of the exported model.
+            num_threads (int): Number of intra-op threads. 0 means the default of ONNX Runtime.
+
+        """
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("onnxruntime is not installed. please check https://onnxruntime.ai.")
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(
+            checkpoint, options, providers=["CPUExecutionProvider"])
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.config = json.loads(metadata["config.json"])
+
+    def inference(self, c, x=None):
+        """Perform inference.
+
+        Args:
+            c (Tensor): Local conditioning auxiliary features (T' ,C).
+            x (Tensor): Input noise signal (T, 1).
+
+        Returns:
+            Tensor: Output tensor (T, out_channels)
+
+        """
+        if x is None:
+            x = torch.randn(len(c) * self.config["hop_size"], 1)
+        y = self.session.run(["y"], {"c": c.cpu().numpy(), "x": x.cpu().numpy()})[0]
+        return torch.from_numpy(y)
+
+
+def compare_with_reference(reference, model, cs, config):
+    """Compare the generator with the reference generator.
+
+    Both generators vocode the same features from the same noise and the
+    real time factors and the multi-resolution STFT distance between the
+    outputs are reported.
+
+    Args:
+        reference (torch.nn.Module): Reference (float32) generator.
+        model (torch.nn.Module): Generator to be evaluated.
+        cs (list): List of features (T', C).
+        config (dict): Config dict loaded from yaml format configuration file.
+
+    Returns:
+        dict: Dict of the averaged real time factors and STFT distances.
+
+    """
+    # lazy load to keep the exported backends free from models and layers
+    from losses import MultiResolutionSTFTLoss
+
+    device = next(reference.parameters()).device
+    criterion = MultiResolutionSTFTLoss(**config["stft_loss_params"]).to(device)
+    hop_size = int(reference.upsample_factor * reference.pqmf.subbands)
+    results = {"reference_rtf": 0.0, "rtf": 0.0,
+               "spectral_convergence_loss": 0.0, "log_stft_magnitude_loss": 0.0}
+    with torch.no_grad():
+        for c in cs:
+            x = torch.randn(len(c) * hop_size, 1).to(device)
+            start = time.time()
+            y_ref = reference.inference(c, x).view(1, -1)
+            results["reference_rtf"] += (time.time() - start) / (y_ref.size(-1) / config["sampling_rate"])
+            start = time.time()
+            y = model.inference(c, x).view(1, -1).float()
+            results["rtf"] += (time.time() - start) / (y.size(-1) / config["sampling_rate"])
+            sc_loss, mag_loss = criterion(y, y_ref)
+            results["spectral_convergence_loss"] += sc_loss.item()
+            results["log_stft_magnitude_loss"] += mag_loss.item()
+    return {key: value / len(cs) for key, value in results.items()}
+
+
+def make_batches(dataset, batch_size=1, bucket_window=8):
+    """Make batches of utterances with similar lengths.
+
+    To keep the memory usage bounded, only ``batch_size * bucket_window``
+    utterances are read ahead and sorted by length at once.
+
+    Args:
+        dataset (Iterable): Dataset or loader returning pairs of utterance id and feature.
+        batch_size (int): Number of utterances in each batch.
+        bucket_window (int): Number of batches to be sorted by length at once.
+
+    Yields:
+        list: List of pairs of utterance id and feature (T', C).
+
+    """
+    if batch_size <= 1:
+        for utt_id, c in dataset:
+            yield [(utt_id, c)]
+        return
+
+    bucket = []
+    for utt_id, c in dataset:
+        bucket.append((utt_id, c))
+        if len(bucket) < batch_size * bucket_window:
+            continue
+        bucket.sort(key=lambda item: len(item[1]))
+        for i in range(0, len(bucket), batch_size):
+            yield bucket[i:i + batch_size]
+        bucket = []
+    bucket.sort(key=lambda item: len(item[1]))
+    for i in range(0, len(bucket), batch_size):
+        yield bucket[i:i + batch_size]
+
+
+class AsyncWriter(object):
+    """Writer encoding and saving waveforms in background threads."""
+
+    def __init__(self, num_threads=2, max_pending=8):
+        """Initialize writer.
+
+        Args:
+            num_threads (int): Number of writing threads.
+            max_pending (int): Maximum number of waveforms waiting to be written.
+                ``write`` blocks when this number is reached.
+
+        """
+        self.executor = ThreadPoolExecutor(max_workers=num_threads)
+        self.semaphore = threading.BoundedSemaphore(max_pending)
+        self.futures = []
+
+    def write(self, path, y, sampling_rate, format="WAV", callback=None):
+        """Write waveform as 16 bit PCM in the background.
+
+        The waveform is written to a temporary file which is renamed to the
+        output filename once complete, so a file with the output filename is
+        never partially written.
+
+        Args:
+            path (str): Output filename.
+            y (ndarray): Waveform (T,).
+            sampling_rate (int): Sampling rate.
+            format (str): Audio file format ("WAV" or "FLAC").
+            callback (func): Function called without arguments after the file is written.
+
+        """
+        self.semaphore.acquire()
+        future = self.executor.submit(self._write, path, y, sampling_rate, format, callback)
+        future.add_done_callback(lambda _: self.semaphore.release())
+        # raise the errors of the finished writes as soon as possible
+        for f in [f for f in self.futures if f.done()]:
+            f.result()
+            self.futures.remove(f)
+        self.futures.append(future)
+
+    def close(self):
+        """Wait for all of the pending writes and raise the first error if any."""
+        self.executor.shutdown(wait=True)
+        for future in self.futures:
+            future.result()
+
+    @staticmethod
+    def _write(path, y, sampling_rate, format, callback):
+        tmp_path = f"{path}.tmp"
+        sf.write(tmp_path, y, sampling_rate, "PCM_16", format=format)
+        os.replace(tmp_path, path)
+        if callback is not None:
+            callback()
+
+
+class CompletionLog(object):
+    """Log of the utterances whose outputs are completely written.
+
+    Every process appends to its own log file in the output directory and
+    the logs of all of the processes are read at start-up, so that the
+    finished utterances can be skipped without checking the output files.
+
+    """
+
+    def __init__(self, outdir, name):
+        """Initialize completion log.
+
+        Args:
+            outdir (str): Output directory including the log files.
+            name (str): Name of the log file written by this process.
+
+        """
+        self.completed = set()
+        for filename in sorted(glob.glob(os.path.join(outdir, "completed*.txt"))):
+            with open(filename) as f:
+                self.completed.update([line.strip() for line in f if len(line.strip()) != 0])
+        self.lock = threading.Lock()
+        self.f = open(os.path.join(outdir, f"completed{name}.txt"), "a")
+
+    def __contains__(self, utt_id):
+        """Return whether the utterance is completed."""
+        return utt_id in self.completed
+
+    def add(self, utt_id):
+        """Record the utterance as completed.
+
+        Args:
+            utt_id (str): Utterance id.
+
+        """
+        with self.lock:
+            self.f.write(f"{utt_id}\n")
+            self.f.flush()
+            self.completed.add(utt_id)
+
+    def close(self):
+        """Close the log file."""
+        self.f.close()
+
+
+def set_logger(verbose=1):
+    """Set logger.
+
+    Args:
+        verbose (int): Logging level. Higher is more logging.
+
+    """
+    if verbose > 1:
         logging.basicConfig(
             level=logging.DEBUG, format="%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s")
-    elif args.verbose > 0:
+    elif verbose > 0:
         logging.basicConfig(
             level=logging.INFO, format="%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s")
     else:
@@ -54,26 +297,66 @@ def main():
             level=logging.WARN, format="%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s")
         logging.warning("Skip DEBUG/INFO messages")
 
-    # check directory existence
-    if not os.path.exists(args.outdir):
-        os.makedirs(args.outdir)
 
-    # load config
-    if args.config is None:
-        dirname = os.path.dirname(args.checkpoint)
-        args.config = os.path.join(dirname, "config.yml")
-    with open(args.config) as f:
-        config = yaml.load(f, Loader=yaml.Loader)
-    config.update(vars(args))
+def decode(args, worker_id=0):
+    """Decode the features in the input directory.
 
-    # check arguments
-    if args.inputdir is None:
-        raise ValueError("Please specify either --inputdir or --feats-scp.")
+    Args:
+        args (Namespace): Parsed command line arguments.
+        worker_id (int): Index of the worker. Only every ``args.workers``-th
+            utterance starting from this index is decoded.
+
+    Returns:
+        dict: Number of utterances, sum of the real time factors, generation time
+            and length in seconds of the generated waveforms.
+
+    """
+    # setup device
+    if torch.cuda.is_available() and not args.force_cpu and args.workers <= 1:
+        device = torch.device("cuda")
+        torch.cuda.set_device(args.rank)
+    else:
+        device = torch.device("cpu")
+
+    # load config and model
+    if args.backend == "pytorch":
+        # lazy load to keep the exported backends free from yaml, models and layers
+        import yaml
+
+        from utils import load_model
+
+        if args.config is None:
+            dirname = os.path.dirname(args.checkpoint)
+            args.config = os.path.join(dirname, "config.yml")
+        with open(args.config) as f:
+            config = yaml.load(f, Loader=yaml.Loader)
+        model = load_model(args.checkpoint, config)
+        model.remove_weight_norm()
+        model = model.eval().to(device)
+    elif args.backend == "torchscript":
+        model = TorchScriptGenerator(args.checkpoint, device)
+        config = dict(model.config)
+    else:
+        device = torch.device("cpu")
+        model = OnnxRuntimeGenerator(args.checkpoint, num_threads=torch.get_num_threads() if args.workers > 1 else 0)
+        config = dict(model.config)
+    logging.info(f"Loaded model parameters from {args.checkpoint}.")
+    config.update(vars(args))
+    if args.quantize is not None and (args.backend != "pytorch" or device.type != "cpu"):
+        raise ValueError("--quantize is supported only by pytorch backend on cpu.")
+    if args.precision != "float32" and (args.backend != "pytorch" or args.quantize is not None):
+        raise ValueError("--precision is supported only by pytorch backend without --quantize.")
+    if args.precision == "bfloat16" and device.type == "cpu":
+        try:
+            if not torch.ops.mkldnn._is_mkldnn_bf16_supported():
+                logging.warning("This cpu does not support bfloat16 natively and the generation may be slow.")
+        except (AttributeError, RuntimeError):
+            logging.warning("Cannot check bfloat16 support of this cpu.")
 
     # get dataset
     if config["format"] == "hdf5":
         mel_query = "*.h5"
-        mel_load_fn = lambda x: read_hdf5(x, "mel")  # NOQA
+        mel_load_fn = functools.partial(read_hdf5, hdf5_path="mel")
     elif config["format"] == "npy":
         mel_query = "*-feats.npy"
         mel_load_fn = np.load
@@ -85,41 +368,316 @@ def main():
             mel_load_fn=mel_load_fn,
             return_utt_id=True,
     )
+    # take the utterances of the shard and then of the worker
+    shard_id, num_shards = args.shard
+    dataset.mel_files = dataset.mel_files[shard_id::num_shards][worker_id::args.workers]
+    dataset.utt_ids = dataset.utt_ids[shard_id::num_shards][worker_id::args.workers]
+
+    # skip already generated utterances before loading them
+    ext = args.output_format
+    completion_log = CompletionLog(config["outdir"], f"-{shard_id}of{num_shards}-{worker_id}")
+    idxs = [idx for idx, utt_id in enumerate(dataset.utt_ids) if utt_id not in completion_log]
+    if len(idxs) != len(dataset):
+        logging.info(f"Skip {len(dataset) - len(idxs)} already generated utterances.")
+        dataset.mel_files = [dataset.mel_files[idx] for idx in idxs]
+        dataset.utt_ids = [dataset.utt_ids[idx] for idx in idxs]
     logging.info(f"The number of features to be decoded = {len(dataset)}.")
 
-    # setup model
-    if torch.cuda.is_available():
-        device = torch.device("cuda")
-        torch.cuda.set_device(args.rank)
-    else:
-        device = torch.device("cpu")
-    model = load_model(args.checkpoint, config)
-    logging.info(f"Loaded model parameters from {args.checkpoint}.")
-    model.remove_weight_norm()
-    model = model.eval().to(device)
+    # quantize model or lower the precision and compare with the float32 model
+    if args.quantize is not None or args.precision != "float32":
+        # the first utterances calibrate the quantization and the next ones are held out for comparison
+        num_calibration = min(args.calibration_num, len(dataset)) if args.quantize == "int8" else 0
+        num_evaluation = min(args.calibration_num, len(dataset) - num_calibration)
+        cs = [torch.tensor(dataset[i][1], dtype=torch.float).to(device)
+              for i in range(num_calibration + num_evaluation)]
+        reference = copy.deepcopy(model)
+        if args.quantize == "int8":
+            model = quantize_generator(model, cs[:num_calibration])
+        else:
+            model.set_residual_precision(args.precision)
+        if num_evaluation != 0:
+            results = compare_with_reference(reference, model, cs[num_calibration:], config)
+            logging.info(f"Converted model to {args.quantize or args.precision} "
+                         f"(RTF = {results['reference_rtf']:.03f} -> {results['rtf']:.03f}, "
+                         f"spectral convergence = {results['spectral_convergence_loss']:.4f}, "
+                         f"log STFT magnitude = {results['log_stft_magnitude_loss']:.4f} "
+                         f"on {num_evaluation} held-out utterances).")
+        else:
+            logging.warning(f"Converted model to {args.quantize or args.precision}, but no utterances "
+                            f"are left to compare with the float32 model.")
+        del reference
 
     # start generation
+    # features are read and pinned by the loader workers ahead of the generation
+    loader_kwargs = {}
+    if args.num_loader_workers > 0:
+        # NOTE: only accepted with workers
+        loader_kwargs["prefetch_factor"] = args.prefetch_factor
+    loader = DataLoader(
+        dataset,
+        batch_size=None,
+        num_workers=args.num_loader_workers,
+        pin_memory=device.type == "cuda",
+        **loader_kwargs,
+    )
+    writer = AsyncWriter(args.writer_threads, args.max_pending_writes)
+    noise_provider = NoiseProvider(args.seed, args.noise_buffer_size)
+    cache = None
+    if args.cache_dir is not None:
+        cache = InferenceCache(args.cache_dir, int(args.cache_size * 2 ** 20))
+        model_id = get_checkpoint_id(args.checkpoint, args.backend, args.quantize, args.precision)
+    num_cached = 0
     total_rtf = 0.0
-    with torch.no_grad(), tqdm(dataset, desc="[decode]") as pbar:
-        for idx, (utt_id, c) in enumerate(pbar, 1):    # utt_id: mel id     c: mel feats
+    total_time = 0.0
+    total_seconds = 0.0
+    idx = 0
+    with torch.no_grad(), tqdm(total=len(dataset), desc=f"[decode {worker_id}]", position=worker_id) as pbar:
+        for batch in make_batches(loader, args.batch_size, args.bucket_window):
+            pbar.update(len(batch))
+
+            # reuse the waveform generated from the same features
+            if cache is not None:
+                key = cache.make_key(batch[0][1], model_id, args.seed)
+                y = cache.get(key)
+                if y is not None:
+                    num_cached += 1
+                    writer.write(os.path.join(config["outdir"], f"{batch[0][0]}_gen.{ext}"),
+                                 y, config["sampling_rate"], format=ext.upper(),
+                                 callback=functools.partial(completion_log.add, batch[0][0]))
+                    continue
+
             # generate
-            if not (os.path.exists(os.path.join(config["outdir"], f"{utt_id}_gen.wav"))):
-                c = torch.tensor(c, dtype=torch.float).to(device)
-                start = time.time()
-                y = model.inference(c).view(-1)
-                rtf = (time.time() - start) / (len(y) / config["sampling_rate"])
-                pbar.set_postfix({"RTF": rtf})
-                total_rtf += rtf
-
-                # save as PCM 16 bit wav file
-                sf.write(os.path.join(config["outdir"], f"{utt_id}_gen.wav"),
-                         y.cpu().numpy(), config["sampling_rate"], "PCM_16")
-                del c,y
-            torch.cuda.empty_cache()
+            cs = [c.float().to(device, non_blocking=True) for _, c in batch]
+            # NOTE: the cached waveforms are shared by the utterances with the same features
+            xs = [noise_provider.get(len(c) * config["hop_size"], None if cache is not None else utt_id, device)
+                  for (utt_id, _), c in zip(batch, cs)]
+            x = xs[0]
+            start = time.time()
+            if args.incremental:
+                ys = [torch.cat(list(model.inference_incremental(
+                    (cs[0][i:i + 1] for i in range(len(cs[0]))), x=x)))]
+            elif args.chunk_size > 0:
+                ys = [torch.cat(list(model.inference_stream(cs[0], x=x, chunk_size=args.chunk_size)))]
+            elif args.chunk_memory > 0:
+                plan = plan_chunks(model, args.chunk_memory * 2 ** 20, num_frames=len(cs[0]))
+                ys = [torch.cat(list(model.inference_stream(cs[0], x=x, chunk_size=plan["chunk_size"])))]
+            elif len(cs) == 1:
+                ys = [model.inference(cs[0], x)]
+            else:
+                ys = model.batch_inference(cs, xs)
+            ys = [y.view(-1) for y in ys]
+            if cache is not None:
+                cache.put(key, ys[0])
+            elapsed = time.time() - start
+            seconds = sum([len(y) for y in ys]) / config["sampling_rate"]
+            rtf = elapsed / seconds
+            pbar.set_postfix({"RTF": rtf})
+            total_rtf += rtf * len(ys)
+            total_time += elapsed
+            total_seconds += seconds
+            idx += len(ys)
 
-    # report average RTF
-    logging.info(f"Finished generation of {idx} utterances (RTF = {total_rtf / idx:.03f}).")
+            # save as PCM 16 bit file while the next batch is generated
+            for (utt_id, _), y in zip(batch, ys):
+                writer.write(os.path.join(config["outdir"], f"{utt_id}_gen.{ext}"),
+                             y.cpu().numpy(), config["sampling_rate"], format=ext.upper(),
+                             callback=functools.partial(completion_log.add, utt_id))
+            del cs, ys
+    writer.close()
+    completion_log.close()
+    if cache is not None:
+        logging.info(f"Reused {num_cached} cached waveforms.")
+    if device.type == "cuda":
+        torch.cuda.empty_cache()
+
+    return {"num_utterances": idx, "total_rtf": total_rtf,
+            "generation_time": total_time, "generated_seconds": total_seconds}
+
+
+def decode_worker(args, worker_id, cores, result_queue):
+    """Decode a shard of the features in a process pinned to the given cores.
+
+    Args:
+        args (Namespace): Parsed command line arguments.
+        worker_id (int): Index of the worker.
+        cores (list): List of cpu core ids used by the worker.
+        result_queue (Queue): Queue to send the result of ``decode``, or the error
+            with the traceback if it failed.
 
+    """
+    try:
+        set_logger(args.verbose)
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cores)
+        torch.set_num_threads(len(cores))
+        logging.info(f"Worker {worker_id} is pinned to cores {cores}.")
+        result_queue.put(decode(args, worker_id))
+    except Exception:
+        result_queue.put({"worker_id": worker_id, "error": traceback.format_exc()})
+
+
+def main():
+    """Run decoding process."""
+    parser = argparse.ArgumentParser(
+        description="Decode dumped features with trained Parallel WaveGAN Generator "
+                    "(See detail in parallel_wavegan/bin/decode.py).")
+    parser.add_argument("--inputdir",'-i', type=str,required=True,
+                        help="directory including feature files. "
+                             "you need to specify either feats-scp or inputdir.")
+    parser.add_argument("--outdir",'-o',type=str, required=True,
+                        help="directory to save generated speech.")
+    parser.add_argument("--checkpoint",'-c',type=str, required=True,
+                        help="checkpoint file or exported model to be loaded.")
+    parser.add_argument("--config", '-g',default=None, type=str,
+                        help="yaml format configuration file. if not explicitly provided, "
+                             "it will be searched in the checkpoint directory. (default=None)")
+    parser.add_argument("--verbose", type=int, default=1,
+                        help="logging level. higher is more logging. (default=1)")
+    parser.add_argument("--rank", default=0, type=int,
+                        help="rank for distributed training. no need to explictly specify.")
+    parser.add_argument("--force_cpu", type=bool, default=False)
+    parser.add_argument("--backend", default="pytorch", type=str,
+                        choices=["pytorch", "torchscript", "onnxruntime"],
+                        help="backend to run the generator. exported backends expect "
+                             "the file made by export.py as --checkpoint. (default=pytorch)")
+    parser.add_argument("--batch_size", "--batch-size", default=1, type=int,
+                        help="number of utterances vocoded in a single forward pass. "
+                             "utterances are grouped by length before batching. (default=1)")
+    parser.add_argument("--bucket_window", default=8, type=int,
+                        help="number of batches read ahead and sorted by length "
+                             "to make the buckets. (default=8)")
+    parser.add_argument("--chunk_size", default=0, type=int,
+                        help="number of frames vocoded at once with overlapping context. "
+                             "0 means the whole utterance is vocoded in a single pass. (default=0)")
+    parser.add_argument("--chunk_memory", default=0, type=float,
+                        help="memory budget of the activations in MB. if --chunk_size is not given, "
+                             "utterances not fitting in the budget are vocoded with the largest "
+                             "exact chunks within the budget. (default=0)")
+    parser.add_argument("--incremental", default=False, action="store_true",
+                        help="whether to vocode frame by frame with cached states. "
+                             "only for generators with causal convolution.")
+    parser.add_argument("--quantize", default=None, type=str, choices=["int8"],
+                        help="quantize the generator for cpu inference. (default=None)")
+    parser.add_argument("--calibration_num", default=5, type=int,
+                        help="number of utterances used to calibrate the quantization, "
+                             "and the number of the following utterances used to compare "
+                             "with the float32 model. (default=5)")
+    parser.add_argument("--precision", default="float32", type=str, choices=["float32", "bfloat16"],
+                        help="precision of the residual blocks. (default=float32)")
+    parser.add_argument("--output_format", default="wav", type=str, choices=["wav", "flac"],
+                        help="format of the generated 16 bit PCM files. (default=wav)")
+    parser.add_argument("--writer_threads", default=2, type=int,
+                        help="number of threads writing the generated files. (default=2)")
+    parser.add_argument("--max_pending_writes", default=8, type=int,
+                        help="maximum number of generated waveforms waiting to be written. (default=8)")
+    parser.add_argument("--num_loader_workers", default=2, type=int,
+                        help="number of processes reading the features ahead. "
+                             "0 means the features are read in the main process. (default=2)")
+    parser.add_argument("--prefetch_factor", default=4, type=int,
+                        help="number of features read ahead by each loader process. (default=4)")
+    parser.add_argument("--cache_dir", default=None, type=str,
+                        help="directory to cache the generated waveforms by the content of the features. "
+                             "features seen before are not vocoded again. (default=None)")
+    parser.add_argument("--cache_size", default=1024, type=float,
+                        help="maximum total size of the cached waveforms in MB. (default=1024)")
+    parser.add_argument("--seed", default=1, type=int,
+                        help="seed of the input noise. the noise of each utterance is reproducible "
+                             "from the seed and the utterance id, or from the seed only "
+                             "with --cache_dir. (default=1)")
+    parser.add_argument("--noise_buffer_size", default=1 << 24, type=int,
+                        help="number of samples of the noise buffer kept on the device. (default=16777216)")
+    parser.add_argument("--shard", default="0/1", type=str,
+                        help="shard of the features to be decoded in the form of i/N (0 <= i < N), "
+                             "to split a corpus over several machines. (default=0/1)")
+    parser.add_argument("--workers", default=1, type=int,
+                        help="number of cpu decoding processes. the utterances are sharded "
+                             "over the processes and each process is pinned to its own cores. (default=1)")
+    args = parser.parse_args()
+
+    # set logger
+    set_logger(args.verbose)
+
+    # check arguments
+    try:
+        args.shard = tuple(int(i) for i in args.shard.split("/"))
+        assert len(args.shard) == 2 and 0 <= args.shard[0] < args.shard[1]
+    except (ValueError, AssertionError):
+        raise ValueError(f"--shard must be in the form of i/N with 0 <= i < N ({args.shard}).")
+    if args.inputdir is None:
+        raise ValueError("Please specify either --inputdir or --feats-scp.")
+    chunked = args.chunk_size > 0 or args.chunk_memory > 0
+    if chunked and args.batch_size > 1:
+        raise ValueError("--chunk_size and --chunk_memory cannot be used together with --batch_size > 1.")
+    if args.incremental and (chunked or args.batch_size > 1):
+        raise ValueError("--incremental cannot be used together with --chunk_size, --chunk_memory "
+                         "or --batch_size > 1.")
+    if args.quantize is not None and (chunked or args.incremental):
+        # NOTE: the quantized convs are wrapped and hide the conv shapes read by these paths
+        raise ValueError("--quantize cannot be used together with --chunk_size, --chunk_memory "
+                         "or --incremental.")
+    if args.cache_dir is not None and args.batch_size > 1:
+        raise ValueError("--cache_dir cannot be used together with --batch_size > 1.")
+    if args.backend != "pytorch" and (chunked or args.batch_size > 1 or args.incremental):
+        raise ValueError("--chunk_size, --chunk_memory, --batch_size and --incremental "
+                         "are supported only by pytorch backend.")
+
+    # check directory existence
+    if not os.path.exists(args.outdir):
+        os.makedirs(args.outdir)
+
+    if args.workers <= 1:
+        results = [decode(args)]
+    else:
+        # split the available cores into contiguous sets, one for each worker
+        cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else \
+            list(range(os.cpu_count()))
+        if args.workers > len(cores):
+            raise ValueError(f"--workers must not exceed the number of cores ({len(cores)}).")
+        core_sets = [cores[len(cores) * i // args.workers:len(cores) * (i + 1) // args.workers]
+                     for i in range(args.workers)]
+        logging.info(f"Decoding with {args.workers} workers ({len(cores)} cores).")
+
+        # NOTE: spawn to start the workers without the threads of the parent
+        ctx = torch.multiprocessing.get_context("spawn")
+        result_queue = ctx.Queue()
+        start = time.time()
+        processes = [ctx.Process(target=decode_worker,
+                                 args=(args, worker_id, core_sets[worker_id], result_queue))
+                     for worker_id in range(args.workers)]
+        for p in processes:
+            p.start()
+        results = []
+        try:
+            while len(results) < len(processes):
+                try:
+                    result = result_queue.get(timeout=1.0)
+                except queue.Empty:
+                    # the workers killed without sending the result (e.g. by the oom killer)
+                    for worker_id, p in enumerate(processes):
+                        if p.exitcode is not None and p.exitcode != 0:
+                            raise RuntimeError(f"Worker {worker_id} exited with code {p.exitcode}.")
+                    continue
+                if "error" in result:
+                    raise RuntimeError(f"Worker {result['worker_id']} failed.\n{result['error']}")
+                results.append(result)
+        finally:
+            # stop the other workers if any of them failed
+            if len(results) < len(processes):
+                for p in processes:
+                    p.terminate()
+            for p in processes:
+                p.join()
+        wall_time = time.time() - start
+        generated_seconds = sum([r["generated_seconds"] for r in results])
+        logging.info(f"Aggregated RTF of {args.workers} workers = "
+                     f"{wall_time / max(generated_seconds, 1e-8):.03f} "
+                     f"({generated_seconds:.1f} sec generated in {wall_time:.1f} sec).")
+
+    # report average RTF
+    num_utterances = sum([r["num_utterances"] for r in results])
+    total_rtf = sum([r["total_rtf"] for r in results])
+    logging.info(f"Finished generation of {num_utterances} utterances "
+                 f"(RTF = {total_rtf / max(num_utterances, 1):.03f}).")
 
 if __name__ == "__main__":
     main()
@@ -88,12 +88,17 @@ class ResidualBlock(torch.nn.Module):
         self.conv1x1_out = Conv1d1x1(gate_out_channels, residual_channels, bias=bias)
         self.conv1x1_skip = Conv1d1x1(gate_out_channels, skip_channels, bias=bias)
 
-    def forward(self, x, c):
+        # mask of the pruned gate channels (see utils.pruning), not included in the state dict
+        self.gate_mask = None
+
+    def forward(self, x, c, projected=False):
         """Calculate forward propagation.
 
         Args:
             x (Tensor): Input tensor (B, residual_channels, T).
             c (Tensor): Local conditioning auxiliary tensor (B, aux_channels, T).
+                If projected is true, the output of conv1x1_aux (B, gate_channels, T).
+            projected (bool): Whether c is already projected by conv1x1_aux.
 
         Returns:
             Tensor: Output tensor for residual connection (B, residual_channels, T).
@@ -107,6 +112,37 @@ class ResidualBlock(torch.nn.Module):
         # remove future time steps if use_causal_conv conv 去除x中residual未来的时间步
         x = x[:, :, :residual.size(-1)] if self.use_causal_conv else x
 
+        return self._gated_output(x, residual, c, projected)
+
+    def incremental_forward(self, x, c, buffer, projected=False):
+        """Calculate forward propagation of new time steps with cached inputs.
+
+        Only available with causal convolution. The buffer works as the queue of
+        the dilated conv: it keeps the inputs of the last (kernel_size - 1) * dilation
+        time steps, so that only the new time steps are computed.
+
+        Args:
+            x (Tensor): Input tensor of the new time steps (B, residual_channels, T).
+            c (Tensor): Local conditioning auxiliary tensor of the new time steps (B, aux_channels, T).
+            buffer (Tensor): Inputs of the previous time steps (B, residual_channels, (kernel_size - 1) * dilation).
+            projected (bool): Whether c is already projected by conv1x1_aux.
+
+        Returns:
+            Tensor: Output tensor for residual connection (B, residual_channels, T).
+            Tensor: Output tensor for skip connection (B, skip_channels, T).
+            Tensor: Updated buffer (B, residual_channels, (kernel_size - 1) * dilation).
+
+        """
+        assert self.use_causal_conv, "Incremental forward requires causal convolution."
+        residual = x
+        x = torch.cat([buffer, F.dropout(x, p=self.dropout, training=self.training)], dim=-1)
+        buffer = x[:, :, x.size(-1) - buffer.size(-1):]
+        x = F.conv1d(x, _get_conv_weight(self.conv), self.conv.bias, dilation=self.conv.dilation)
+        x, s = self._gated_output(x, residual, c, projected)
+        return x, s, buffer
+
+    def _gated_output(self, x, residual, c, projected):
+        """Apply gated activation and output convs to the dilated conv output."""
         # split into two part for gated activation  (B, gate_channels, T) -> 2*(B, gate_channels/2, T)
         splitdim = 1
         xa, xb = x.split(x.size(splitdim) // 2, dim=splitdim)  # 拆分后分别通过tanh与sigmoid
@@ -114,11 +150,14 @@ class ResidualBlock(torch.nn.Module):
         # local conditioning: WaveNet中的条件输入,同样经过拆分后附加到xa,xb上
         if c is not None:
             assert self.conv1x1_aux is not None
-            c = self.conv1x1_aux(c)  # condition经过一层卷积
+            if not projected:
+                c = self.conv1x1_aux(c)  # condition经过一层卷积
             ca, cb = c.split(c.size(splitdim) // 2, dim=splitdim)
             xa, xb = xa + ca, xb + cb
 
         x = torch.tanh(xa) * torch.sigmoid(xb)
+        if self.gate_mask is not None:
+            x = x * self.gate_mask.view(1, -1, 1)
 
         # for skip connection
         s = self.conv1x1_skip(x)
@@ -129,6 +168,101 @@ class ResidualBlock(torch.nn.Module):
         return x, s  # 返回residual 和 skip
 
 
+def _get_conv_weight(conv):
+    """Return the weight of conv layer taking weight norm into account."""
+    if hasattr(conv, "weight_g"):
+        # NOTE: weight is only updated by the pre-forward hook of weight norm
+        return conv.weight_g * conv.weight_v / conv.weight_v.norm(2, dim=(1, 2), keepdim=True)
+    return conv.weight
+
+
+def project_auxiliary_features(blocks, c):
+    """Apply conv1x1_aux of all residual blocks to the same conditioning at once.
+
+    Args:
+        blocks (ModuleList): List of ResidualBlock modules.
+        c (Tensor): Local conditioning auxiliary tensor (B, aux_channels, T).
+
+    Returns:
+        list: List of the projected conditioning of each block (B, gate_channels, T).
+
+    """
+    assert all([f.conv1x1_aux is not None for f in blocks])
+    aux_weight = torch.cat([_get_conv_weight(f.conv1x1_aux) for f in blocks], dim=0).to(c.dtype)
+    return F.conv1d(c, aux_weight).split([f.conv1x1_aux.out_channels for f in blocks], dim=1)
+
+
+def fused_residual_stack(blocks, x, c, projected=False):
+    """Calculate forward propagation of a chain of residual blocks with fused convs.
+
+    This is numerically equivalent to calling the residual blocks one by one
+    and summing up the skip outputs, but the ``conv1x1_aux`` projections of
+    all blocks are computed with a single conv, ``conv1x1_out`` and
+    ``conv1x1_skip`` of each block are computed with a single conv followed by
+    a split, and the gated activation is applied in-place when gradients are
+    not required. The parameters of the blocks are used as is,
+    so that existing checkpoints can be loaded unchanged.
+
+    Note that the conditioning of all blocks is kept in memory at once, i.e.
+    (B, layers * gate_channels, T), which is larger than the per-block one.
+
+    Args:
+        blocks (ModuleList): List of ResidualBlock modules.
+        x (Tensor): Input tensor (B, residual_channels, T).
+        c (Tensor): Local conditioning auxiliary tensor (B, aux_channels, T).
+            If projected is true, iterable of the projected conditioning of each block
+            (B, gate_channels, T), which can be computed lazily.
+        projected (bool): Whether c is already projected by conv1x1_aux.
+
+    Returns:
+        Tensor: Output tensor for residual connection (B, residual_channels, T).
+        Tensor: Sum of the outputs for skip connection (B, skip_channels, T).
+
+    """
+    inplace = not torch.is_grad_enabled()
+
+    # local conditioning of all blocks at once
+    if c is None:
+        cs = [None] * len(blocks)
+    elif projected:
+        cs = c
+    else:
+        cs = project_auxiliary_features(blocks, c)
+
+    skips = 0
+    for f, c_ in zip(blocks, cs):
+        residual = x
+        x = F.dropout(x, p=f.dropout, training=f.training)
+        x = f.conv(x)
+        x = x[:, :, :residual.size(-1)] if f.use_causal_conv else x
+
+        # gated activation
+        if c_ is not None:
+            x = x.add_(c_) if inplace else x + c_
+        xa, xb = x.split(x.size(1) // 2, dim=1)
+        if inplace:
+            x = torch.tanh_(xa).mul_(torch.sigmoid_(xb))
+        else:
+            x = torch.tanh(xa) * torch.sigmoid(xb)
+        if f.gate_mask is not None:
+            x = x * f.gate_mask.view(1, -1, 1)
+
+        # residual and skip connections with a single conv
+        out_weight = torch.cat([_get_conv_weight(f.conv1x1_out), _get_conv_weight(f.conv1x1_skip)], dim=0)
+        if f.conv1x1_out.bias is not None:
+            out_bias = torch.cat([f.conv1x1_out.bias, f.conv1x1_skip.bias], dim=0)
+        else:
+            out_bias = None
+        x, h = F.conv1d(x, out_weight, out_bias).split(
+            [f.conv1x1_out.out_channels, f.conv1x1_skip.out_channels], dim=1)
+        if inplace:
+            x = x.add_(residual).mul_(math.sqrt(0.5))
+        else:
+            x = (x + residual) * math.sqrt(0.5)
+        skips = skips + h
+
+    return x, skips
+
 
 class ResidualEmbeddingBlock(torch.nn.Module):
     """Residual block module in WaveNet."""
@@ -81,6 +81,8 @@ class UpsampleNetwork(torch.nn.Module):
         """
         super(UpsampleNetwork, self).__init__()
         self.use_causal_conv = use_causal_conv  # 是否使用因果卷积
+        # the same linear filter is applied to each channel independently
+        self.channelwise_linear = nonlinear_activation is None and freq_axis_kernel_size == 1
         self.up_layers = torch.nn.ModuleList()
         for scale in upsample_scales:
             # interpolation layer
@@ -163,6 +165,7 @@ class ConvInUpsampleNetwork(torch.nn.Module):
             freq_axis_kernel_size=freq_axis_kernel_size,
             use_causal_conv=use_causal_conv,
         )
+        self.channelwise_linear = self.upsample.channelwise_linear
 
     def forward(self, c):
         """Calculate forward propagation.
@@ -7,13 +7,17 @@ import math
 
 import numpy as np
 import torch
+import torch.nn.functional as F
 
 from layers import Conv1d
 from layers import Conv1d1x1
 from layers import ResidualBlock
+from layers import fused_residual_stack
+from layers import project_auxiliary_features
 from layers import upsample
 from layers import PQMF
 import models
+from utils import get_context_size
 
 
 class Generator1(torch.nn.Module):
@@ -37,6 +41,8 @@ class Generator1(torch.nn.Module):
                  upsample_conditional_features=True,
                  upsample_net="ConvInUpsampleNetwork",
                  upsample_params={"upsample_scales": [4, 4, 4, 4]},
+                 use_fused_residual_stack=False,
+                 project_aux_before_upsample=False,
                  ):
         """Initialize Generator module.
 
@@ -47,7 +53,8 @@ class Generator1(torch.nn.Module):
             layers (int): Number of residual block layers.
             stacks (int): Number of stacks i.e., dilation cycles.
             residual_channels (int): Number of channels in residual conv.
-            gate_channels (int):  Number of channels in gated conv.
+            gate_channels (Union[int, list]): Number of channels in gated conv,
+                or list of them for each layer (e.g. after structured pruning).
             skip_channels (int): Number of channels in skip conv.
             aux_channels (int): Number of channels for auxiliary feature conv.
             aux_context_window (int): Context window size for auxiliary feature.
@@ -59,6 +66,12 @@ class Generator1(torch.nn.Module):
             upsample_conditional_features (bool): Whether to use upsampling network.
             upsample_net (str): Upsampling network architecture.
             upsample_params (dict): Upsampling network parameters.
+            use_fused_residual_stack (bool): Whether to run the residual blocks with
+                fused convs (see layers.fused_residual_stack). It does not change the parameters.
+            project_aux_before_upsample (bool): Whether to apply the 1x1 conditioning convs
+                of all residual blocks at once at frame rate and upsample the projected
+                features of each block, which is exact only when the upsampling network is
+                a channel-wise linear filter. It does not change the parameters.
 
         """
         super(Generator1, self).__init__()
@@ -69,6 +82,7 @@ class Generator1(torch.nn.Module):
         self.layers = layers
         self.stacks = stacks
         self.kernel_size = kernel_size
+        self.use_fused_residual_stack = use_fused_residual_stack
 
         # check the number of layers and stacks
         assert layers % stacks == 0
@@ -100,15 +114,23 @@ class Generator1(torch.nn.Module):
         else:
             self.upsample_net = None
             self.upsample_factor = 1
+        if project_aux_before_upsample:
+            assert getattr(self.upsample_net, "channelwise_linear", False), \
+                "Conditioning can be projected before upsampling only with a channel-wise linear upsampling network."
+        self.project_aux_before_upsample = project_aux_before_upsample
+        self.residual_dtype = torch.float32
 
         # define residual blocks
+        if isinstance(gate_channels, int):
+            gate_channels = [gate_channels] * layers
+        assert len(gate_channels) == layers
         self.conv_layers = torch.nn.ModuleList()
         for layer in range(layers):
             dilation = 2 ** (layer % layers_per_stack)
             conv = ResidualBlock(
                 kernel_size=kernel_size,
                 residual_channels=residual_channels,
-                gate_channels=gate_channels,
+                gate_channels=gate_channels[layer],
                 skip_channels=skip_channels,
                 aux_channels=aux_channels,
                 dilation=dilation,
@@ -150,18 +172,28 @@ class Generator1(torch.nn.Module):
 
         # perform upsampling
 
-        if c is not None and self.upsample_net is not None:
+        projected = c is not None and self.project_aux_before_upsample
+        if projected:
+            # NOTE: projected features of each block are computed lazily
+            c = self._project_and_upsample(c)
+        elif c is not None and self.upsample_net is not None:
             c = self.upsample_net(c)
             assert c.size(-1) * 4 == x.size(-1)
         x = self.pqmf.analysis(x)
+        if self.residual_dtype != torch.float32 and c is not None:
+            c = (c_.to(self.residual_dtype) for c_ in c) if projected else c.to(self.residual_dtype)
 
         # encode to hidden representation
-        x = self.first_conv(x)
-        skips = 0
-        for f in self.conv_layers:
-            x, h = f(x, c)
-            skips += h
-        skips *= math.sqrt(1.0 / len(self.conv_layers))
+        x = self.first_conv(x.to(self.residual_dtype))
+        if self.use_fused_residual_stack:
+            x, skips = fused_residual_stack(self.conv_layers, x, c, projected=projected)
+        else:
+            skips = 0
+            cs = c if projected else [c] * len(self.conv_layers)
+            for f, c_ in zip(self.conv_layers, cs):
+                x, h = f(x, c_, projected=projected)
+                skips += h
+        skips = skips.float() * math.sqrt(1.0 / len(self.conv_layers))
 
         # apply final layers
         x = skips
@@ -176,6 +208,9 @@ class Generator1(torch.nn.Module):
     def inference(self, c=None, x=None):
         """Perform inference.
 
+        The residual blocks run in the precision set by ``set_residual_precision``,
+        which persists across the calls.
+
         Args:
             c (Union[Tensor, ndarray]): Local conditioning auxiliary features (T' ,C).
             x (Union[Tensor, ndarray]): Input noise signal (T, 1).
@@ -199,6 +234,293 @@ class Generator1(torch.nn.Module):
 
         return self.forward(x, c).squeeze(0).transpose(1, 0)
 
+    def batch_inference(self, cs, xs=None):
+        """Perform inference for a batch of utterances with different lengths.
+
+        The features are padded to the longest one in the batch by replicating
+        the last frame, vocoded with a single forward pass and each waveform
+        is trimmed back to its own length. Group utterances of similar length
+        to keep the padding (and the effect of the padded frames on the tail
+        of the shorter waveforms) small. The residual blocks run in the precision
+        set by ``set_residual_precision``, which persists across the calls.
+
+        Args:
+            cs (list): List of local conditioning auxiliary features (T_i' ,C).
+            xs (list): List of input noise signals (T_i, 1). If not provided,
+                the noise is sampled.
+
+        Returns:
+            list: List of output tensors (T_i, out_channels).
+
+        """
+        device = next(self.parameters()).device
+        cs = [c if isinstance(c, torch.Tensor) else torch.tensor(c, dtype=torch.float)
+              for c in cs]
+        lengths = [len(c) for c in cs]
+        max_length = max(lengths)
+        hop_size = self.upsample_factor * self.pqmf.subbands
+
+        # (T_i', C) -> (1, C, T_max' + 2 * aux_context_window)
+        c_batch = []
+        for c in cs:
+            c = c.to(device).transpose(1, 0).unsqueeze(0)
+            c = torch.nn.ReplicationPad1d(self.aux_context_window)(c)
+            c = F.pad(c, (0, max_length - c.size(-1) + 2 * self.aux_context_window), mode="replicate")
+            c_batch.append(c)
+        c = torch.cat(c_batch, dim=0)
+        if xs is None:
+            x = torch.randn(len(cs), 1, max_length * hop_size).to(device)
+        else:
+            x = torch.cat([F.pad(x.to(device).transpose(1, 0).unsqueeze(0), (0, max_length * hop_size - len(x)))
+                           for x in xs], dim=0)
+
+        y = self.forward(x, c)
+        extra_length = y.size(-1) - x.size(-1)
+        return [y[i, :, :length * hop_size + extra_length].transpose(1, 0)
+                for i, length in enumerate(lengths)]
+
+    def inference_stream(self, c, x=None, chunk_size=200, context_size=None):
+        """Perform chunk-wise inference.
+
+        The features are split into chunks of ``chunk_size`` frames, each chunk
+        is vocoded together with ``context_size`` frames of context on both
+        sides and the context part is trimmed from the output. As long as the
+        context covers the receptive field, the concatenation of the yielded
+        blocks is the same as the output of ``inference`` with the same noise,
+        while the peak memory only depends on the chunk size. The residual blocks
+        run in the precision set by ``set_residual_precision``, which persists
+        across the calls.
+
+        Args:
+            c (Union[Tensor, ndarray]): Local conditioning auxiliary features (T' ,C).
+            x (Union[Tensor, ndarray]): Input noise signal (T, 1).
+            chunk_size (int): Number of frames generated in each block.
+            context_size (Union[int, tuple]): Number of context frames on each side of a chunk,
+                or pair of them for the past and future sides. If not provided, the exact
+                context is derived from the receptive field (see utils.get_context_size).
+
+        Yields:
+            Tensor: Output block (T_chunk, out_channels).
+
+        """
+        device = next(self.parameters()).device
+        hop_size = self.upsample_factor * self.pqmf.subbands
+        if not isinstance(c, torch.Tensor):
+            c = torch.tensor(c, dtype=torch.float)
+        if x is None:
+            x = torch.randn(len(c) * hop_size, 1)
+        elif not isinstance(x, torch.Tensor):
+            x = torch.tensor(x, dtype=torch.float)
+        x = x.to(device).transpose(1, 0).unsqueeze(0)
+        c = c.to(device).transpose(1, 0).unsqueeze(0)
+        c = torch.nn.ReplicationPad1d(self.aux_context_window)(c)
+        if context_size is None:
+            context_size = get_context_size(self)["frames"]
+        elif isinstance(context_size, int):
+            context_size = (context_size, context_size)
+
+        num_frames = c.size(-1) - 2 * self.aux_context_window
+        for start in range(0, num_frames, chunk_size):
+            end = min(start + chunk_size, num_frames)
+            context_start = max(start - context_size[0], 0)
+            context_end = min(end + context_size[1], num_frames)
+            y = self.forward(
+                x[:, :, context_start * hop_size:context_end * hop_size],
+                c[:, :, context_start:context_end + 2 * self.aux_context_window],
+            )
+
+            # trim the context (the last block keeps the tail of the output convs)
+            y_start = (start - context_start) * hop_size
+            y_end = (end - context_start) * hop_size if end < num_frames else y.size(-1)
+            yield y[:, :, y_start:y_end].squeeze(0).transpose(1, 0)
+
+    @torch.no_grad()
+    def inference_incremental(self, cs, x=None):
+        """Perform incremental inference for causal generators.
+
+        Every layer keeps a queue of its past inputs, so each new chunk of
+        features (a single frame for live use) only computes its own time
+        steps and the work per frame stays constant. The PQMF filters and the
+        output convs need a few future samples, so the blocks are delayed by
+        a fixed number of samples and the rest of the waveform is flushed
+        when the features are exhausted. The concatenation of the yielded
+        blocks is the same as the output of ``inference`` with the same noise.
+        The residual blocks run in the precision set by ``set_residual_precision``,
+        which persists across the calls.
+
+        Args:
+            cs (iterable): Iterable of local conditioning auxiliary features (T_i', C).
+            x (Union[Tensor, ndarray]): Input noise signal of the whole utterance (T, 1).
+                If not provided, the noise is sampled for each chunk.
+
+        Yields:
+            Tensor: Output block (T_block, out_channels).
+
+        """
+        assert all([f.use_causal_conv for f in self.conv_layers]), \
+            "Incremental inference requires causal convolution."
+        assert not hasattr(self.first_conv, "weight_g"), \
+            "Please remove weight norm before incremental inference."
+        upsample_net = self.upsample_net
+        conv_in = None
+        if isinstance(upsample_net, upsample.ConvInUpsampleNetwork):
+            conv_in = upsample_net.conv_in
+            upsample_net = upsample_net.upsample
+        assert isinstance(upsample_net, upsample.UpsampleNetwork), \
+            "Incremental inference is not supported for this upsampling network."
+        assert all([f.mode == "nearest" for f in upsample_net.up_layers if isinstance(f, upsample.Stretch2d)])
+
+        device = next(self.parameters()).device
+        hop_size = self.upsample_factor * self.pqmf.subbands
+        if x is not None and not isinstance(x, torch.Tensor):
+            x = torch.tensor(x, dtype=torch.float)
+        pqmf_taps = self.pqmf.analysis_filter.size(-1)
+        pqmf_pad = pqmf_taps // 2
+
+        # queues keeping the past inputs of each layer (initialized with the left padding)
+        c_queue = None  # replication padding of the first frame
+        up_queues = [torch.zeros(1, 1, self.aux_channels, f.kernel_size[1] - 1, device=device)
+                     for f in upsample_net.up_layers if isinstance(f, torch.nn.Conv2d)]
+        x_queue = torch.zeros(1, 1, pqmf_pad, device=device)
+        h_queues = [torch.zeros(1, f.conv.in_channels, (f.conv.kernel_size[0] - 1) * f.conv.dilation[0],
+                                device=device, dtype=self.residual_dtype) for f in self.conv_layers]
+        y_queues = [torch.zeros(1, self.pqmf.subbands, pqmf_pad, device=device),
+                    torch.zeros(1, 1, self.pqmf_conv1.padding[0], device=device),
+                    torch.zeros(1, self.pqmf_conv1.out_channels, self.pqmf_conv2.padding[0], device=device)]
+        c_pending = torch.zeros(1, self.aux_channels, 0, device=device)
+
+        def _valid_conv(queue, x, conv_fn, kernel_size, stride=1):
+            # run conv on the queued and new inputs without padding and keep the inputs still needed
+            x = torch.cat([queue, x], dim=-1)
+            num_outputs = max((x.size(-1) - kernel_size) // stride + 1, 0)
+            y = conv_fn(x[..., :(num_outputs - 1) * stride + kernel_size]) if num_outputs > 0 else None
+            return y, x[..., num_outputs * stride:]
+
+        def _generate(noise, final=False):
+            nonlocal x_queue, c_pending
+            # PQMF analysis of the noise (only the subband samples whose window is available)
+            if final:
+                noise = torch.cat([noise, noise.new_zeros(1, 1, pqmf_pad)], dim=-1)
+            z, x_queue = _valid_conv(x_queue, noise, lambda x_: F.conv1d(
+                x_, self.pqmf.analysis_filter, stride=self.pqmf.subbands), pqmf_taps, self.pqmf.subbands)
+            if z is None:
+                return None
+
+            # residual blocks with the upsampled features of the same time steps
+            c, c_pending = c_pending[:, :, :z.size(-1)], c_pending[:, :, z.size(-1):]
+            assert c.size(-1) == z.size(-1)
+            z = self.first_conv(z.to(self.residual_dtype))
+            c = c.to(self.residual_dtype)
+            skips = 0
+            for i, f in enumerate(self.conv_layers):
+                z, h, h_queues[i] = f.incremental_forward(z, c, h_queues[i])
+                skips += h
+            z = skips.float() * math.sqrt(1.0 / len(self.conv_layers))
+            for f in self.last_conv_layers:
+                z = f(z)
+
+            # PQMF synthesis and output convs (their right padding is added at the end)
+            z = F.conv_transpose1d(z, self.pqmf.updown_filter * self.pqmf.subbands, stride=self.pqmf.subbands)
+            for i, (conv_fn, kernel_size, pad) in enumerate([
+                (lambda x_: F.conv1d(x_, self.pqmf.synthesis_filter), pqmf_taps, pqmf_pad),
+                (lambda x_: F.conv1d(x_, self.pqmf_conv1.weight, self.pqmf_conv1.bias),
+                 self.pqmf_conv1.kernel_size[0], self.pqmf_conv1.padding[0]),
+                (lambda x_: F.conv1d(x_, self.pqmf_conv2.weight, self.pqmf_conv2.bias),
+                 self.pqmf_conv2.kernel_size[0], self.pqmf_conv2.padding[0]),
+            ]):
+                if final:
+                    z = torch.cat([z, z.new_zeros(1, z.size(1), pad)], dim=-1)
+                z, y_queues[i] = _valid_conv(y_queues[i], z, conv_fn, kernel_size)
+                if z is None:
+                    return None
+            return z.squeeze(0).transpose(1, 0)
+
+        num_frames = 0
+        for c in cs:
+            if not isinstance(c, torch.Tensor):
+                c = torch.tensor(c, dtype=torch.float)
+            c = c.to(device).transpose(1, 0).unsqueeze(0)
+            if c_queue is None:
+                c_queue = c[:, :, :1].repeat(1, 1, self.aux_context_window)
+
+            # upsample the new frames
+            if conv_in is not None:
+                c, c_queue = _valid_conv(c_queue, c, conv_in, conv_in.kernel_size[0])
+            c = c.unsqueeze(1)
+            j = 0
+            for f in upsample_net.up_layers:
+                if isinstance(f, torch.nn.Conv2d):
+                    c, up_queues[j] = _valid_conv(up_queues[j], c, lambda x_: F.conv2d(
+                        x_, f.weight, f.bias, padding=(f.padding[0], 0)), f.kernel_size[1])
+                    j += 1
+                else:
+                    c = f(c)
+            c_pending = torch.cat([c_pending, c.squeeze(1)], dim=-1)
+
+            # noise of the new frames
+            if x is None:
+                noise = torch.randn(1, 1, c.size(-1) * self.pqmf.subbands, device=device)
+            else:
+                noise = x[num_frames * hop_size:(num_frames + c.size(-1) // self.upsample_factor) * hop_size]
+                noise = noise.to(device).transpose(1, 0).unsqueeze(0)
+            num_frames += c.size(-1) // self.upsample_factor
+
+            y = _generate(noise)
+            if y is not None:
+                yield y
+
+        # flush the delayed samples
+        if num_frames > 0:
+            y = _generate(c_pending.new_zeros(1, 1, 0), final=True)
+            if y is not None:
+                yield y
+
+    def _project_and_upsample(self, c):
+        """Apply the conditioning convs of all residual blocks at frame rate.
+
+        Since the upsampling network is linear and applied to each channel
+        independently, it commutes with the 1x1 conditioning convs (which have
+        no bias), so the projection is done once at frame rate instead of once
+        per block at sample rate. The projected features of each block are
+        upsampled lazily, right before the block uses them.
+
+        Args:
+            c (Tensor): Local conditioning auxiliary features (B, C, T').
+
+        Returns:
+            generator: Upsampled projected features of each block (B, gate_channels, T).
+
+        """
+        upsample_net = self.upsample_net
+        if isinstance(upsample_net, upsample.ConvInUpsampleNetwork):
+            c_ = upsample_net.conv_in(c)
+            c = c_[:, :, :-self.aux_context_window] if upsample_net.use_causal_conv else c_
+            upsample_net = upsample_net.upsample
+        return (upsample_net(c_) for c_ in project_auxiliary_features(self.conv_layers, c))
+
+    def set_residual_precision(self, precision="float32"):
+        """Set the precision of the first conv and the residual blocks.
+
+        The residual blocks dominate the computation and the memory traffic of
+        their 64/128-channel feature maps, so running them in bfloat16 roughly
+        halves the traffic. The upsampling network, the output layers, the PQMF
+        filters and the output convs always run in float32.
+
+        The weights are cast in-place, so the precision applies to all the later
+        calls of ``inference``, ``batch_inference``, ``inference_stream`` and
+        ``inference_incremental``. Setting "float32" back does not restore the
+        float32 weights rounded to bfloat16, so keep a copy of the model to
+        compare with the float32 outputs.
+
+        Args:
+            precision (str): Precision name ("float32" or "bfloat16").
+
+        """
+        assert precision in ["float32", "bfloat16"], f"Not supported precision ({precision})."
+        self.residual_dtype = getattr(torch, precision)
+        self.first_conv.to(self.residual_dtype)
+        self.conv_layers.to(self.residual_dtype)
+
     def remove_weight_norm(self):
         """Remove weight normalization module from all of the layers."""
         def _remove_weight_norm(m):
@@ -255,7 +577,9 @@ class Generator2(torch.nn.Module):
         self.in_channels = in_channels
         self.out_channels = out_channels
         self.aux_channels = aux_channels
+        self.layers = layers
         self.stacks = stacks
+        self.kernel_sizes = kernel_sizes
         self.pqmf = PQMF(out_channels)
         self.aux_context_window = aux_context_window
         # define first convolution
@@ -384,5 +708,9 @@ class Generator2(torch.nn.Module):
 
     @property
     def receptive_field_size(self):
-        """Return receptive field size."""
-        return self._get_receptive_field_size(self.layers, self.stacks, self.kernel_size)
+        """Return receptive field size of the wider one of the low and up band residual stacks."""
+        # NOTE: dilation of each branch cycles every `stacks` layers
+        return max([
+            self._get_receptive_field_size(layers, 1, kernel_size, dilation=lambda x, s=stacks: 2 ** (x % s))
+            for layers, stacks, kernel_size in zip(self.layers, self.stacks, self.kernel_sizes)
+        ])
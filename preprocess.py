@@ -17,6 +17,7 @@ from multiprocessing.pool import Pool
 from datasets import AudioDataset
 from frontend.audio_preprocess import logmelfilterbank, pitchfeats, f0_to_coarse
 from frontend.audio_world_process import world_feature_extract, convert_continuos_f0, low_pass_filter
+from utils import build_singer_registry
 from utils import write_hdf5
 from utils import simple_table
 
@@ -100,6 +101,10 @@ def main():
                         help="directory to dump feature files.")
     parser.add_argument("--config",'-c', type=str, required=True,
                         help="yaml format configuration file.")
+    parser.add_argument("--singer_registry", default=None, type=str,
+                        help="hdf5 file to register the centroid embedding of each singer. (default=None)")
+    parser.add_argument("--singer_delimiter", default="_", type=str,
+                        help="delimiter between the singer id and the rest of the utterance id. (default=_)")
     parser.add_argument("--verbose", type=int, default=1,
                         help="logging level. higher is more logging. (default=1)")
     args = parser.parse_args()
@@ -198,5 +203,8 @@ def main():
 
     write2file(values, config, args.dumpdir)
 
+    if config["use_embed"] and args.singer_registry is not None:
+        build_singer_registry([v[1] for v in values], args.singer_registry, args.singer_delimiter)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Serve trained Multi-Singer over a local HTTP endpoint.
+
+The server keeps a single generator in memory and gathers the incoming
+requests into micro-batches, so that the start-up cost of ``inference.py``
+is paid only once. A request is a POST to ``/vocode`` whose body is a mel
+spectrogram (T', C) serialized with ``numpy.save`` and the response is a
+16 bit PCM wav file.
+
+Examples:
+    $ python server.py -c checkpoints/checkpoint-400000steps.pkl --port 8000
+
+    >>> from server import request_vocode
+    >>> y, sr = request_vocode(mel, "http://127.0.0.1:8000/vocode")
+
+"""
+
+import argparse
+import io
+import logging
+import os
+import queue
+import threading
+import time
+import urllib.request
+
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+import numpy as np
+import soundfile as sf
+import torch
+import yaml
+
+from utils import get_checkpoint_id
+from utils import InferenceCache
+from utils import load_model
+from utils import NoiseProvider
+
+
+class VocodeRequest(object):
+    """Pending vocoding request."""
+
+    def __init__(self, c, key=None):
+        """Initialize request.
+
+        Args:
+            c (ndarray): Local conditioning auxiliary features (T', C).
+            key (str): Cache key of the generated waveform.
+
+        """
+        self.c = c
+        self.key = key
+        self.y = None
+        self.error = None
+        self.arrival_time = time.time()
+        self.done = threading.Event()
+
+
+class VocoderServer(object):
+    """Vocoder holding a loaded generator and batching the requests."""
+
+    def __init__(self, model, device, max_batch_size=8, max_latency=0.05,
+                 cache=None, model_id=None, seed=1):
+        """Initialize vocoder server.
+
+        Args:
+            model (torch.nn.Module): Generator with weight norm removed.
+            device (torch.device): Pytorch device instance.
+            max_batch_size (int): Maximum number of requests in a micro-batch.
+            max_latency (float): Maximum time in seconds to wait for more requests
+                after the first request of a micro-batch arrived.
+            cache (InferenceCache): Cache of the generated waveforms. Requests with
+                the features seen before are served without the generator, and the
+                others are vocoded one by one to cache the same waveforms as inference.py.
+            model_id (str): Identifier of the generator used for the cache keys.
+            seed (int): Seed of the input noise.
+
+        """
+        self.model = model
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.cache = cache
+        self.model_id = model_id
+        self.seed = seed
+        self.noise_provider = NoiseProvider(seed)
+        self.queue = queue.Queue()
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def vocode(self, c):
+        """Vocode features, blocking until the waveform is generated.
+
+        Args:
+            c (ndarray): Local conditioning auxiliary features (T', C).
+
+        Returns:
+            ndarray: Generated waveform (T,).
+
+        """
+        if self.cache is not None:
+            key = self.cache.make_key(c, self.model_id, self.seed)
+            y = self.cache.get(key)
+            if y is not None:
+                return y
+            request = VocodeRequest(c, key=key)
+        else:
+            request = VocodeRequest(c)
+        self.queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.y
+
+    def _next_batch(self):
+        """Gather requests until the batch is full or the deadline is reached."""
+        batch = [self.queue.get()]
+        deadline = batch[0].arrival_time + self.max_latency
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    @torch.no_grad()
+    def _run(self):
+        """Vocode micro-batches in the background."""
+        while True:
+            batch = self._next_batch()
+            # NOTE: the tail of a padded waveform in a micro-batch depends on the other requests,
+            #   so the waveforms to be cached are vocoded one by one
+            groups = [[request] for request in batch if request.key is not None]
+            uncached = [request for request in batch if request.key is None]
+            if len(uncached) != 0:
+                groups.append(uncached)
+            for group in groups:
+                self._vocode(group)
+
+    def _vocode(self, batch):
+        """Vocode requests with a single forward pass."""
+        try:
+            cs = [torch.tensor(request.c, dtype=torch.float).to(self.device) for request in batch]
+            start = time.time()
+            # the noise only depends on the seed to reproduce the cached waveforms
+            hop_size = self.model.upsample_factor * self.model.pqmf.subbands
+            xs = [self.noise_provider.get(len(c) * hop_size, device=self.device) for c in cs]
+            if len(cs) == 1:
+                ys = [self.model.inference(cs[0], xs[0])]
+            else:
+                ys = self.model.batch_inference(cs, xs)
+            logging.debug(f"Vocoded {len(cs)} requests in {time.time() - start:.03f} sec.")
+            for request, y in zip(batch, ys):
+                request.y = y.view(-1).cpu().numpy()
+                if request.key is not None:
+                    self.cache.put(request.key, request.y)
+        except Exception as e:
+            logging.exception("Failed to vocode the requests.")
+            for request in batch:
+                request.error = e
+        for request in batch:
+            request.done.set()
+
+
+def make_handler(vocoder, sampling_rate):
+    """Make HTTP request handler class bound to the vocoder.
+
+    Args:
+        vocoder (VocoderServer): Vocoder to serve.
+        sampling_rate (int): Sampling rate of the generated waveform.
+
+    Returns:
+        class: Request handler class.
+
+    """
+    class VocodeHandler(BaseHTTPRequestHandler):
+        """Handler of the vocoding requests."""
+
+        def do_POST(self):
+            """Vocode mel spectrogram in the request body."""
+            if self.path != "/vocode":
+                self.send_error(404, f"Unknown path ({self.path}).")
+                return
+            try:
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                c = np.load(io.BytesIO(body), allow_pickle=False)
+                assert c.ndim == 2, "Mel spectrogram must be a (T', C) array."
+            except Exception as e:
+                self.send_error(400, f"Invalid request ({e}).")
+                return
+            try:
+                y = vocoder.vocode(c)
+            except Exception as e:
+                self.send_error(500, f"Failed to vocode ({e}).")
+                return
+
+            buffer = io.BytesIO()
+            sf.write(buffer, y, sampling_rate, "PCM_16", format="WAV")
+            data = buffer.getvalue()
+            self.send_response(200)
+            self.send_header("Content-Type", "audio/wav")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            """Redirect access log to logging."""
+            logging.debug(f"{self.address_string()} {format % args}")
+
+    return VocodeHandler
+
+
+def request_vocode(c, url="http://127.0.0.1:8000/vocode", timeout=None):
+    """Send mel spectrogram to the server and receive the waveform.
+
+    Args:
+        c (ndarray): Local conditioning auxiliary features (T', C).
+        url (str): URL of the vocode endpoint.
+        timeout (float): Timeout in seconds.
+
+    Returns:
+        ndarray: Generated waveform (T,).
+        int: Sampling rate.
+
+    """
+    buffer = io.BytesIO()
+    np.save(buffer, np.asarray(c, dtype=np.float32))
+    request = urllib.request.Request(
+        url, data=buffer.getvalue(), headers={"Content-Type": "application/octet-stream"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return sf.read(io.BytesIO(response.read()), dtype="float32")
+
+
+def main():
+    """Run vocoder server."""
+    parser = argparse.ArgumentParser(
+        description="Serve trained Multi-Singer Generator over a local HTTP endpoint.")
+    parser.add_argument("--checkpoint", '-c', type=str, required=True,
+                        help="checkpoint file to be loaded.")
+    parser.add_argument("--config", '-g', default=None, type=str,
+                        help="yaml format configuration file. if not explicitly provided, "
+                             "it will be searched in the checkpoint directory. (default=None)")
+    parser.add_argument("--host", default="127.0.0.1", type=str,
+                        help="address to bind. (default=127.0.0.1)")
+    parser.add_argument("--port", default=8000, type=int,
+                        help="port to bind. (default=8000)")
+    parser.add_argument("--max_batch_size", default=8, type=int,
+                        help="maximum number of requests vocoded in a single forward pass. (default=8)")
+    parser.add_argument("--max_latency", default=0.05, type=float,
+                        help="maximum time in seconds to wait for gathering a batch. (default=0.05)")
+    parser.add_argument("--cache_dir", default=None, type=str,
+                        help="directory to cache the generated waveforms by the content of the features. "
+                             "features seen before are not vocoded again and the others are vocoded "
+                             "without batching. (default=None)")
+    parser.add_argument("--cache_size", default=1024, type=float,
+                        help="maximum total size of the cached waveforms in MB. (default=1024)")
+    parser.add_argument("--seed", default=1, type=int,
+                        help="seed of the input noise. (default=1)")
+    parser.add_argument("--verbose", type=int, default=1,
+                        help="logging level. higher is more logging. (default=1)")
+    parser.add_argument("--rank", default=0, type=int,
+                        help="gpu id to be used. (default=0)")
+    args = parser.parse_args()
+
+    # set logger
+    if args.verbose > 1:
+        logging.basicConfig(
+            level=logging.DEBUG, format="%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s")
+    elif args.verbose > 0:
+        logging.basicConfig(
+            level=logging.INFO, format="%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s")
+    else:
+        logging.basicConfig(
+            level=logging.WARN, format="%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s")
+        logging.warning("Skip DEBUG/INFO messages")
+
+    # load config
+    if args.config is None:
+        dirname = os.path.dirname(args.checkpoint)
+        args.config = os.path.join(dirname, "config.yml")
+    with open(args.config) as f:
+        config = yaml.load(f, Loader=yaml.Loader)
+    config.update(vars(args))
+
+    # setup model
+    if torch.cuda.is_available():
+        device = torch.device("cuda")
+        torch.cuda.set_device(args.rank)
+    else:
+        device = torch.device("cpu")
+    model = load_model(args.checkpoint, config)
+    logging.info(f"Loaded model parameters from {args.checkpoint}.")
+    model.remove_weight_norm()
+    model = model.eval().to(device)
+
+    # start serving
+    cache, model_id = None, None
+    if args.cache_dir is not None:
+        cache = InferenceCache(args.cache_dir, int(args.cache_size * 2 ** 20))
+        # NOTE: same as the float32 pytorch backend of inference.py to share the cached waveforms
+        model_id = get_checkpoint_id(args.checkpoint, "pytorch", None, "float32")
+    vocoder = VocoderServer(model, device, args.max_batch_size, args.max_latency,
+                            cache=cache, model_id=model_id, seed=args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(vocoder, config["sampling_rate"]))
+    logging.info(f"Serving on http://{args.host}:{args.port}/vocode.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+        logging.info("Stopped serving.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+"""Common fixtures of the tests."""
+
+import os
+import sys
+
+import pytest
+import torch
+
+# make the top level modules of the repository importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import Generator1  # NOQA
+
+
+@pytest.fixture
+def generator():
+    """Tiny Generator1 with weight norm removed."""
+    torch.manual_seed(1)
+    model = Generator1(
+        in_channels=4,
+        out_channels=1,
+        kernel_size=5,
+        layers=4,
+        stacks=2,
+        residual_channels=8,
+        gate_channels=16,
+        skip_channels=8,
+        aux_channels=80,
+        aux_context_window=2,
+        upsample_params={"upsample_scales": [2, 4, 4]},
+    )
+    model.remove_weight_norm()
+    return model.eval()
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+"""Test parity of the exported generators with the eager one."""
+
+import json
+
+import pytest
+import torch
+
+from export import check_parity
+from export import export_onnx
+from export import export_torchscript
+from export import InferenceWrapper
+
+
+@pytest.mark.parametrize("format", ["torchscript", "onnx"])
+def test_export_parity(tmp_path, generator, format):
+    wrapper = InferenceWrapper(generator).eval()
+    hop_size = int(wrapper.model.upsample_factor * wrapper.model.pqmf.subbands)
+    frames = 20
+    c = torch.randn(frames, wrapper.model.aux_channels)
+    x = torch.randn(frames * hop_size, 1)
+    path = str(tmp_path / f"generator.{'pt' if format == 'torchscript' else 'onnx'}")
+    config = {"config.json": json.dumps({"hop_size": hop_size})}
+    with torch.no_grad():
+        if format == "torchscript":
+            export_torchscript(wrapper, (c, x), path, config)
+        else:
+            pytest.importorskip("onnx")
+            pytest.importorskip("onnxruntime")
+            export_onnx(wrapper, (c, x), path, config)
+
+    # the time axis must be dynamic, so check with another number of frames
+    assert check_parity(wrapper, path, format, hop_size, frames=2 * frames + 3) < 1e-4
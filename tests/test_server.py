@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+"""Test round trip between the vocoder server and the client."""
+
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer
+
+import numpy as np
+import pytest
+import torch
+
+from server import make_handler
+from server import request_vocode
+from server import VocoderServer
+from utils import InferenceCache
+from utils import NoiseProvider
+
+
+def serve(vocoder):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(vocoder, 24000))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/vocode"
+
+
+@pytest.fixture
+def url(generator):
+    server, url = serve(VocoderServer(generator, torch.device("cpu"), max_batch_size=4, max_latency=0.1))
+    yield url
+    server.shutdown()
+    server.server_close()
+
+
+def vocode_locally(generator, c):
+    hop_size = generator.upsample_factor * generator.pqmf.subbands
+    x = NoiseProvider(1).get(len(c) * hop_size)
+    with torch.no_grad():
+        y = generator.inference(torch.tensor(c), x).view(-1).numpy()
+    return np.clip(y, -1.0, 1.0)
+
+
+def test_round_trip(generator, url):
+    c = np.random.RandomState(0).randn(20, 80).astype(np.float32)
+    y, sr = request_vocode(c, url, timeout=60)
+    assert sr == 24000
+    np.testing.assert_allclose(y, vocode_locally(generator, c), atol=1e-3)
+
+
+def test_concurrent_requests(generator, url):
+    # requests of different lengths are vocoded together in a micro-batch
+    rng = np.random.RandomState(0)
+    cs = [rng.randn(length, 80).astype(np.float32) for length in [20, 20, 18]]
+    with ThreadPoolExecutor(len(cs)) as executor:
+        results = list(executor.map(lambda c: request_vocode(c, url, timeout=60), cs))
+    hop_size = generator.upsample_factor * generator.pqmf.subbands
+    for c, (y, _) in zip(cs, results):
+        assert len(y) == len(vocode_locally(generator, c))
+        assert len(y) >= len(c) * hop_size
+
+
+def test_cached_requests(generator, tmp_path):
+    # the cached waveforms must not depend on the other requests gathered together
+    cache = InferenceCache(str(tmp_path))
+    vocoder = VocoderServer(generator, torch.device("cpu"), max_batch_size=4, max_latency=0.1,
+                            cache=cache, model_id="test", seed=1)
+    server, url = serve(vocoder)
+    rng = np.random.RandomState(0)
+    cs = [rng.randn(length, 80).astype(np.float32) for length in [20, 12, 16]]
+    try:
+        for _ in range(2):
+            with ThreadPoolExecutor(len(cs)) as executor:
+                results = list(executor.map(lambda c: request_vocode(c, url, timeout=60), cs))
+            for c, (y, _) in zip(cs, results):
+                np.testing.assert_allclose(y, vocode_locally(generator, c), atol=1e-3)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert len(list(tmp_path.glob("*.npy"))) == len(cs)
@@ -4,12 +4,15 @@
 """Train Multi-Singer."""
 
 import argparse
+import contextlib
 import logging
 import ipdb
 import os
 import sys
+import time
 
 from collections import defaultdict
+from collections import OrderedDict
 from sklearn.metrics.pairwise import cosine_similarity
 import matplotlib
 import numpy as np
@@ -29,9 +32,13 @@ from datasets import AudioMelEmbedDataset
 from datasets import Embeds_Collater
 from layers import PQMF
 from losses import MultiResolutionSTFTLoss
+from utils import get_pruning_sparsity
+from utils import load_model
 from utils import read_hdf5
 import os
 from utils import simple_table
+from utils import SingerEmbeddingRegistry
+from utils import update_gate_masks
 from encoder import inference as encoder
 
 
@@ -53,6 +60,7 @@ class Trainer(object):
                  scheduler,
                  config,
                  device=torch.device("cpu"),
+                 teacher=None,
                  ):
         """Initialize trainer.
 
@@ -66,6 +74,8 @@ class Trainer(object):
             scheduler (dict): Dict of schedulers. It must contrain "generator" and "discriminator" schedulers.
             config (dict): Config dict loaded from yaml format configuration file.
             device (torch.deive): Pytorch device instance.
+            teacher (torch.nn.Module): Trained generator whose outputs the generator learns
+                to match (distillation). If not provided, the output matching loss is not used.
 
         """
         self.steps = steps
@@ -78,10 +88,30 @@ class Trainer(object):
         self.scheduler = scheduler
         self.config = config
         self.device = device
+        self.teacher = teacher
         self.writer = SummaryWriter(config["outdir"])
         self.finish_train = False
         self.total_train_loss = defaultdict(float)
         self.total_eval_loss = defaultdict(float)
+        self.reference_embeds = OrderedDict()
+        self.warned_unfused_batch = False
+
+        # step time measurement, which waits for the gpu kernels at every step
+        self.measure_step_time = config.get("measure_step_time", False)
+        self.discriminator_steps = 0
+
+        # mixed precision (float16 with loss scaling on gpu, bfloat16 on cpu)
+        self.use_amp = config.get("use_amp", False)
+        amp_dtype = config.get("amp_dtype", None) or ("float16" if device.type == "cuda" else "bfloat16")
+        self.amp_dtype = getattr(torch, amp_dtype)
+        if self.use_amp and not hasattr(torch, "autocast"):
+            # NOTE: torch < 1.10 only supports float16 on gpu
+            assert device.type == "cuda" and self.amp_dtype == torch.float16, \
+                "Mixed precision on cpu or with bfloat16 requires torch >= 1.10."
+        self.scaler = {
+            name: torch.cuda.amp.GradScaler(enabled=self.use_amp and self.amp_dtype == torch.float16)
+            for name in ["generator", "discriminator", "embed_discriminator"]
+        }
 
     def run(self):
         """Run training."""
@@ -115,9 +145,15 @@ class Trainer(object):
                 "generator": self.scheduler["generator"].state_dict(),
                 "discriminator": self.scheduler["discriminator"].state_dict(),
             },
+            "scaler": {name: scaler.state_dict() for name, scaler in self.scaler.items()},
             "steps": self.steps,
             "epochs": self.epochs,
         }
+        if self.config.get("pruning_params", None) is not None:
+            generator = getattr(self.model["generator"], "module", self.model["generator"])
+            state_dict["pruning"] = {
+                "gate_masks": [f.gate_mask for f in generator.conv_layers],
+            }
         if self.config["distributed"]:
             state_dict["model"] = {
                 "generator": self.model["generator"].module.state_dict(),
@@ -148,6 +184,10 @@ class Trainer(object):
         else:
             self.model["generator"].load_state_dict(state_dict["model"]["generator"])
             self.model["discriminator"].load_state_dict(state_dict["model"]["discriminator"])
+        if "pruning" in state_dict:
+            generator = getattr(self.model["generator"], "module", self.model["generator"])
+            for f, mask in zip(generator.conv_layers, state_dict["pruning"]["gate_masks"]):
+                f.gate_mask = mask.to(f.conv1x1_out.weight.device) if mask is not None else None
         if not load_only_params:
             self.steps = state_dict["steps"]
             self.epochs = state_dict["epochs"]
@@ -155,9 +195,15 @@ class Trainer(object):
             self.optimizer["discriminator"].load_state_dict(state_dict["optimizer"]["discriminator"])
             self.scheduler["generator"].load_state_dict(state_dict["scheduler"]["generator"])
             self.scheduler["discriminator"].load_state_dict(state_dict["scheduler"]["discriminator"])
+            for name, scaler_state_dict in state_dict.get("scaler", {}).items():
+                if len(scaler_state_dict) != 0:
+                    self.scaler[name].load_state_dict(scaler_state_dict)
 
     def _train_step(self, batch):
         """Train model one step."""
+        if self.measure_step_time:
+            step_start = self._time()
+
         # parse batch
         x = []
         x.append(batch['noise'])
@@ -170,17 +216,14 @@ class Trainer(object):
         #######################
         #      Generator      #
         #######################
-        y_ = self.model["generator"](*x).to(self.device)
+        with self._autocast():
+            y_ = self.model["generator"](*x).to(self.device)
+        # NOTE: the losses including the stft and the speaker encoder are computed in float32
+        y_ = y_.float()
 
         # Singer Perceptual loss
-        embed_loss = 0
+        embed_loss, _, _ = self._singer_perceptual_loss(y_, y, batch)
         spk_similariy = []
-        for i in range(y_.shape[0]):
-            preprocess_ = encoder.preprocess_wav_torch(y_[i]).squeeze()
-            loss_embed_ = encoder.embed_utterance_torch(preprocess_)
-            preprocess = encoder.preprocess_wav_torch(y[i]).squeeze()
-            loss_embed = encoder.embed_utterance_torch(preprocess)
-            embed_loss += self.criterion["mse"](loss_embed,loss_embed_)
 
         self.total_train_loss["train/embed_loss"] += embed_loss.item()
         self.total_train_loss["train/spk_similariy"] = np.mean(np.array(spk_similariy))
@@ -193,11 +236,23 @@ class Trainer(object):
         self.total_train_loss["train/log_stft_magnitude_loss"] += mag_loss.item()
         gen_loss += sc_loss + mag_loss
 
+        # output matching loss with the teacher
+        if self.teacher is not None:
+            distill_sc_loss, distill_mag_loss, distill_wav_loss = self._distillation_loss(x, y_)
+            self.total_train_loss["train/distill_spectral_convergence_loss"] += distill_sc_loss.item()
+            self.total_train_loss["train/distill_log_stft_magnitude_loss"] += distill_mag_loss.item()
+            self.total_train_loss["train/distill_waveform_l1_loss"] += distill_wav_loss.item()
+            gen_loss += self.config.get("lambda_distill", 1.0) * (
+                distill_sc_loss + distill_mag_loss + distill_wav_loss)
+
 
         # adversarial loss
         if self.steps > self.config["discriminator_train_start_steps"]:
-            p_ = self.model["discriminator"](y_)
-            embed_p_ = self.model["embed_discriminator"](y_, embed)
+            # gradients of the discriminators are discarded here, so skip their all-reduce
+            with self._no_sync("discriminator", "embed_discriminator"), self._autocast():
+                p_ = self.model["discriminator"](y_)
+                embed_p_ = self.model["embed_discriminator"](y_, embed)
+            p_, embed_p_ = p_.float(), embed_p_.float()
 
             uncondition_adv_loss = self.criterion["mse"](p_, p_.new_ones(p_.size()))
             self.total_train_loss["train/uncondition_adv_loss"] += uncondition_adv_loss.item()
@@ -214,28 +269,50 @@ class Trainer(object):
 
         # update generator
         self.optimizer["generator"].zero_grad()
-        gen_loss.backward()
+        self.scaler["generator"].scale(gen_loss).backward()
         if self.config["generator_grad_norm"] > 0:
+            self.scaler["generator"].unscale_(self.optimizer["generator"])
             torch.nn.utils.clip_grad_norm_(
                 self.model["generator"].parameters(),
                 self.config["generator_grad_norm"])
-        self.optimizer["generator"].step()
+        self.scaler["generator"].step(self.optimizer["generator"])
+        self.scaler["generator"].update()
         self.scheduler["generator"].step()
 
         #######################
         #    Discriminator    #
         #######################
         if self.steps > self.config["discriminator_train_start_steps"] and self.steps % self.config["interval"] == 0:
-            # re-compute y_ which leads better quality
-            with torch.no_grad():
-                y_ = self.model["generator"](*x)
+            if self.measure_step_time:
+                discriminator_start = self._time()
+            if not self.config.get("reuse_generator_output", False):
+                # re-compute y_ which leads better quality
+                with torch.no_grad(), self._autocast():
+                    y_ = self.model["generator"](*x)
 
             # discriminator loss
-            embed_p = self.model["embed_discriminator"](y, embed)
-            embed_p_ = self.model["embed_discriminator"](y_.detach(), embed)
-
-            p = self.model["discriminator"](y)
-            p_ = self.model["discriminator"](y_.detach())
+            fuse_batch = self.config.get("fuse_discriminator_batch", False)
+            if fuse_batch and y_.size(-1) < y.size(-1):
+                if not self.warned_unfused_batch:
+                    logging.warning(f"Discriminators run on the real and fake samples separately, since the "
+                                    f"generated samples are shorter ({y_.size(-1)} < {y.size(-1)}).")
+                    self.warned_unfused_batch = True
+                fuse_batch = False
+            with self._autocast():
+                if fuse_batch:
+                    # real and fake samples in a single forward (no layer mixes the samples)
+                    # NOTE: the generated samples can be a few samples longer than the natural ones
+                    #   (e.g. 12804 for 12800 with the default config), which are cropped to be stacked
+                    ys = torch.cat([y, y_[..., :y.size(-1)].detach()], dim=0)
+                    embed_p, embed_p_ = self.model["embed_discriminator"](ys, torch.cat([embed, embed], dim=0)).chunk(2)
+                    p, p_ = self.model["discriminator"](ys).chunk(2)
+                else:
+                    embed_p = self.model["embed_discriminator"](y, embed)
+                    embed_p_ = self.model["embed_discriminator"](y_.detach(), embed)
+
+                    p = self.model["discriminator"](y)
+                    p_ = self.model["discriminator"](y_.detach())
+            p, p_, embed_p, embed_p_ = p.float(), p_.float(), embed_p.float(), embed_p_.float()
 
             real_loss = self.criterion["mse"](p, p.new_ones(p.size()))
             fake_loss = self.criterion["mse"](p_, p_.new_zeros(p_.size()))
@@ -251,28 +328,136 @@ class Trainer(object):
             self.total_train_loss["train/speaker_condition_discriminator_loss"] += speaker_condition_discriminator_loss.item()
             # update discriminator
             self.optimizer["discriminator"].zero_grad()
-            uncondition_discriminator_loss.backward()
+            self.scaler["discriminator"].scale(uncondition_discriminator_loss).backward()
             if self.config["discriminator_grad_norm"] > 0:
+                self.scaler["discriminator"].unscale_(self.optimizer["discriminator"])
                 torch.nn.utils.clip_grad_norm_(
                     self.model["discriminator"].parameters(),
                     self.config["discriminator_grad_norm"])
-            self.optimizer["discriminator"].step()
+            self.scaler["discriminator"].step(self.optimizer["discriminator"])
+            self.scaler["discriminator"].update()
             self.scheduler["discriminator"].step()
 
             # update discriminator
             self.optimizer["embed_discriminator"].zero_grad()
-            speaker_condition_discriminator_loss.backward()
+            self.scaler["embed_discriminator"].scale(speaker_condition_discriminator_loss).backward()
             if self.config["embed_discriminator_grad_norm"] > 0:
+                self.scaler["embed_discriminator"].unscale_(self.optimizer["embed_discriminator"])
                 torch.nn.utils.clip_grad_norm_(
                     self.model["embed_discriminator"].parameters(),
                     self.config["embed_discriminator_grad_norm"])
-            self.optimizer["embed_discriminator"].step()
+            self.scaler["embed_discriminator"].step(self.optimizer["embed_discriminator"])
+            self.scaler["embed_discriminator"].update()
             self.scheduler["embed_discriminator"].step()
+            if self.measure_step_time:
+                self.total_train_loss["train/discriminator_step_time"] += self._time() - discriminator_start
+                self.discriminator_steps += 1
+        if self.measure_step_time:
+            self.total_train_loss["train/step_time"] += self._time() - step_start
+
         # update counts
         self.steps += 1
         self.tqdm.update(1)
         self._check_train_finish()
 
+    def _time(self):
+        """Return current time after the queued gpu kernels finished."""
+        if self.device.type == "cuda":
+            torch.cuda.synchronize(self.device)
+        return time.time()
+
+    def _autocast(self):
+        """Return autocast context of the model forwards for mixed precision training."""
+        if hasattr(torch, "autocast"):
+            return torch.autocast(self.device.type, dtype=self.amp_dtype, enabled=self.use_amp)
+        return torch.cuda.amp.autocast(enabled=self.use_amp)
+
+    def _no_sync(self, *names):
+        """Return context skipping the gradient all-reduce of the distributed models."""
+        stack = contextlib.ExitStack()
+        for name in names:
+            if hasattr(self.model[name], "no_sync"):
+                stack.enter_context(self.model[name].no_sync())
+        return stack
+
+    def _singer_perceptual_loss(self, y_, y, batch):
+        """Calculate singer perceptual loss.
+
+        The embeddings of the natural waveforms are given by ``reference_embed`` in the config:
+        "online" embeds them every step, "cache" reuses the embeddings of the same crops
+        (the encoder is frozen, so the loss is the same as "online") and "stored" uses the
+        embeddings stored with the features (an approximation by the utterance embeddings).
+        The waveforms to be embedded are embedded with a single forward pass of the encoder.
+        The few extra samples of the generated waveforms (e.g. 12804 samples for a 12800-sample
+        crop with the default config) are cropped for it, and only if the generated waveforms are
+        shorter, they are embedded separately from the natural ones.
+
+        Args:
+            y_ (Tensor): Generated waveforms (B, 1, T).
+            y (Tensor): Natural waveforms (B, 1, T).
+            batch (dict): Batch made by the collater.
+
+        Returns:
+            Tensor: Sum of the MSE between the embeddings of each pair.
+            Tensor: Embeddings of the generated waveforms (B, D).
+            Tensor: Embeddings of the natural waveforms (B, D).
+
+        """
+        mode = self.config.get("reference_embed", "online")
+        if y_.size(-1) > y.size(-1):
+            y_ = y_[..., :y.size(-1)]
+        if mode == "stored":
+            wavs = [y_]
+            embeds = batch["embed"].squeeze(-1).to(self.device)
+        elif mode == "cache":
+            keys = [(utt_id, start_frame, y.size(-1))
+                    for utt_id, start_frame in zip(batch["utt_ids"], batch["start_frames"].tolist())]
+            idxs = [i for i, key in enumerate(keys) if key not in self.reference_embeds]
+            wavs = [y_, y[idxs]]
+        else:
+            wavs = [y_, y]
+
+        # NOTE: the generated waveforms shorter than the natural ones are embedded separately
+        if all([wav.size(-1) == y_.size(-1) for wav in wavs]):
+            wavs = [torch.cat(wavs, dim=0)]
+        embeds_ = torch.cat([encoder.embed_utterances_torch(encoder.preprocess_wavs_torch(wav.squeeze(1)))
+                             for wav in wavs if wav.size(0) != 0], dim=0)
+        if mode == "cache":
+            embeds_, new_embeds = embeds_[:len(y_)], embeds_[len(y_):].detach().cpu()
+            for i, embed in zip(idxs, new_embeds):
+                self.reference_embeds[keys[i]] = embed
+            for key in keys:
+                self.reference_embeds.move_to_end(key)
+            while len(self.reference_embeds) > self.config.get("reference_embed_cache_size", 100000):
+                self.reference_embeds.popitem(last=False)
+            embeds = torch.stack([self.reference_embeds[key] for key in keys]).to(self.device)
+        elif mode != "stored":
+            embeds_, embeds = embeds_.chunk(2, dim=0)
+
+        # NOTE: mean over the embedding dimension and sum over the batch as per utterance losses
+        embed_loss = self.criterion["mse"](embeds, embeds_) * y.size(0)
+        return embed_loss, embeds_, embeds
+
+    def _distillation_loss(self, x, y_):
+        """Calculate output matching loss between the generator and the teacher.
+
+        Args:
+            x (tuple): Inputs of the generator.
+            y_ (Tensor): Output of the generator (B, 1, T).
+
+        Returns:
+            Tensor: Spectral convergence loss.
+            Tensor: Log STFT magnitude loss.
+            Tensor: L1 loss of the waveforms.
+
+        """
+        with torch.no_grad(), self._autocast():
+            y_teacher = self.teacher(*x)
+        y_teacher = y_teacher.float()
+        sc_loss, mag_loss = self.criterion["stft"](y_.squeeze(1), y_teacher.squeeze(1))
+        wav_loss = torch.nn.functional.l1_loss(y_, y_teacher)
+        return sc_loss, mag_loss, wav_loss
+
     def _train_epoch(self):
         """Train model one epoch."""
         for train_steps_per_epoch, batch in enumerate(self.data_loader["train"], 1):
@@ -280,6 +465,7 @@ class Trainer(object):
             self._train_step(batch)
 
             # check interval
+            self._check_pruning_interval()
             self._check_log_interval()
             self._check_eval_interval()
             self._check_save_interval()
@@ -319,18 +505,13 @@ class Trainer(object):
         #######################
         #      Generator      #
         #######################
-        y_ = self.model["generator"](*x).to(self.device)
+        with self._autocast():
+            y_ = self.model["generator"](*x).to(self.device)
+        y_ = y_.float()
 
         # Singer Perceptual loss
-        embed_loss = 0
-        spk_similariy = []
-        for i in range(y_.shape[0]):
-            preprocess_ = encoder.preprocess_wav_torch(y_[i]).squeeze()
-            loss_embed_ = encoder.embed_utterance_torch(preprocess_)
-            preprocess = encoder.preprocess_wav_torch(y[i]).squeeze()
-            loss_embed = encoder.embed_utterance_torch(preprocess)
-            embed_loss += self.criterion["mse"](loss_embed,loss_embed_)
-            spk_similariy.append(cosine_similarity(loss_embed_.reshape(1,256).cpu().numpy(), loss_embed.reshape(1,256).cpu().numpy()))
+        embed_loss, loss_embed_, loss_embed = self._singer_perceptual_loss(y_, y, batch)
+        spk_similariy = np.diag(cosine_similarity(loss_embed_.cpu().numpy(), loss_embed.cpu().numpy()))
 
         gen_loss = self.config["lambda_embed"] * embed_loss
         self.total_eval_loss["eval/embed_loss"] += embed_loss.item()
@@ -340,9 +521,20 @@ class Trainer(object):
         sc_loss, mag_loss = self.criterion["stft"](y_.squeeze(1), y.squeeze(1))
         gen_loss += sc_loss + mag_loss
 
+        # output matching loss with the teacher
+        if self.teacher is not None:
+            distill_sc_loss, distill_mag_loss, distill_wav_loss = self._distillation_loss(x, y_)
+            self.total_eval_loss["eval/distill_spectral_convergence_loss"] += distill_sc_loss.item()
+            self.total_eval_loss["eval/distill_log_stft_magnitude_loss"] += distill_mag_loss.item()
+            self.total_eval_loss["eval/distill_waveform_l1_loss"] += distill_wav_loss.item()
+            gen_loss += self.config.get("lambda_distill", 1.0) * (
+                distill_sc_loss + distill_mag_loss + distill_wav_loss)
+
         # Unconditional/Conditional Loss
-        p_ = self.model["discriminator"](y_)
-        embed_p_ = self.model["embed_discriminator"](y_, embed)
+        with self._autocast():
+            p_ = self.model["discriminator"](y_)
+            embed_p_ = self.model["embed_discriminator"](y_, embed)
+        p_, embed_p_ = p_.float(), embed_p_.float()
 
         uncondition_adv_loss = self.criterion["mse"](p_, p_.new_ones(p_.size()))
         gen_loss += self.config["lambda_adv"] * uncondition_adv_loss
@@ -352,11 +544,13 @@ class Trainer(object):
         #######################
         #    Discriminator    #
         #######################
-        p = self.model["discriminator"](y)
-        p_ = self.model["discriminator"](y_)
+        with self._autocast():
+            p = self.model["discriminator"](y)
+            p_ = self.model["discriminator"](y_)
 
-        embed_p = self.model["embed_discriminator"](y, embed)
-        embed_p_ = self.model["embed_discriminator"](y_, embed)
+            embed_p = self.model["embed_discriminator"](y, embed)
+            embed_p_ = self.model["embed_discriminator"](y_, embed)
+        p, p_, embed_p, embed_p_ = p.float(), p_.float(), embed_p.float(), embed_p_.float()
 
         # Unconditional Loss
         real_loss = self.criterion["mse"](p, p.new_ones(p.size()))
@@ -471,7 +665,9 @@ class Trainer(object):
             self.writer.add_scalar(key, value, self.steps)
 
     def _check_save_interval(self):
-        if self.steps % self.config["save_interval_steps"] == 0:
+        # all the processes have the same parameters, so only the first one saves them
+        is_first_process = not self.config["distributed"] or torch.distributed.get_rank() == 0
+        if self.steps % self.config["save_interval_steps"] == 0 and is_first_process:
             self.save_checkpoint(
                 os.path.join(self.config["outdir"], f"checkpoint-{self.steps}steps.pkl"))
             logging.info(f"Successfully saved checkpoint @ {self.steps} steps.")
@@ -483,12 +679,31 @@ class Trainer(object):
     def _check_log_interval(self):
         if self.steps % self.config["log_interval_steps"] == 0:
             for key in self.total_train_loss.keys():
-                self.total_train_loss[key] /= self.config["log_interval_steps"]
+                if key == "train/discriminator_step_time":
+                    # averaged over the steps which updated the discriminators
+                    self.total_train_loss[key] /= max(self.discriminator_steps, 1)
+                else:
+                    self.total_train_loss[key] /= self.config["log_interval_steps"]
                 logging.info(f"(Steps: {self.steps}) {key} = {self.total_train_loss[key]:.4f}.")
             self._write_to_tensorboard(self.total_train_loss)
 
             # reset
             self.total_train_loss = defaultdict(float)
+            self.discriminator_steps = 0
+
+    def _check_pruning_interval(self):
+        params = self.config.get("pruning_params", None)
+        if params is None or self.steps % params.get("interval_steps", 1000) != 0:
+            return
+        sparsity = get_pruning_sparsity(
+            self.steps, params["target_sparsity"], params["start_steps"], params["end_steps"])
+        if sparsity == 0.0:
+            return
+        generator = getattr(self.model["generator"], "module", self.model["generator"])
+        num_remains = update_gate_masks(generator.conv_layers, sparsity)
+        self.writer.add_scalar("train/pruning_sparsity", sparsity, self.steps)
+        logging.info(f"(Steps: {self.steps}) Pruned {sparsity * 100:.1f}% of gate channels "
+                     f"(remaining channels of each layer = {num_remains}).")
 
     def _check_train_finish(self):
         if self.steps >= self.config["train_max_steps"]:
@@ -545,13 +760,14 @@ def main():
         # see https://discuss.pytorch.org/t/what-does-torch-backends-cudnn-benchmark-do/5936
         torch.backends.cudnn.benchmark = True
         torch.cuda.set_device(args.rank)
-        # setup for distributed training
-        # see example: https://github.com/NVIDIA/apex/tree/master/examples/simple/distributed
-        if "WORLD_SIZE" in os.environ:
-            args.world_size = int(os.environ["WORLD_SIZE"])
-            args.distributed = args.world_size > 1
-        if args.distributed:
-            torch.distributed.init_process_group(backend="nccl", init_method="env://")
+    # setup for distributed training, nccl on gpus and gloo on cpus
+    # see https://pytorch.org/docs/stable/distributed.html
+    if "WORLD_SIZE" in os.environ:
+        args.world_size = int(os.environ["WORLD_SIZE"])
+        args.distributed = args.world_size > 1
+    if args.distributed:
+        backend = "nccl" if device.type == "cuda" else "gloo"
+        torch.distributed.init_process_group(backend=backend, init_method="env://")
 
     # suppress logging for distributed training
     # if args.rank != 0:
@@ -595,6 +811,11 @@ def main():
         frames_threshold = None
 
     train_text = os.path.join(args.inputdir, 'train.txt')
+    if config.get("singer_registry", None) is not None:
+        singer_registry = SingerEmbeddingRegistry(config["singer_registry"])
+        logging.info(f"Use centroid embeddings of {len(singer_registry.singer_ids())} singers.")
+    else:
+        singer_registry = None
 
     train_dataset = AudioMelEmbedDataset(
         root_file=train_text,
@@ -602,7 +823,10 @@ def main():
         frames_threshold=frames_threshold,
         use_f0=config['use_f0'],
         use_chroma=config['use_chroma'],
+        use_utt_id=config.get("reference_embed", "online") == "cache",
         allow_cache=config.get("allow_cache", False),  # keep compatibility
+        singer_registry=singer_registry,
+        singer_delimiter=config.get("singer_delimiter", "_"),
     )
 
     logging.info(f"The number of training files = {len(train_dataset)}.")
@@ -614,7 +838,10 @@ def main():
         frames_threshold=frames_threshold*10,
         use_f0=config['use_f0'],
         use_chroma=config['use_chroma'],
+        use_utt_id=config.get("reference_embed", "online") == "cache",
         allow_cache=config.get("allow_cache", False),  # keep compatibility
+        singer_registry=singer_registry,
+        singer_delimiter=config.get("singer_delimiter", "_"),
     )
 
     logging.info(f"The number of development files = {len(dev_dataset)}.")
@@ -633,7 +860,8 @@ def main():
         # keep compatibility
         use_noise_input=config['use_noise_input'],
         use_f0=config['use_f0'],
-        use_chroma=config['use_chroma']
+        use_chroma=config['use_chroma'],
+        crop_step=config.get("crop_step", 1),
     )
     eval_collater = Embeds_Collater(
         batch_max_steps=10*config["batch_max_steps"],
@@ -644,7 +872,8 @@ def main():
         # keep compatibility
         use_noise_input=config['use_noise_input'],
         use_f0=config['use_f0'],
-        use_chroma=config['use_chroma']
+        use_chroma=config['use_chroma'],
+        crop_step=config.get("crop_step", 1),
     )
     sampler = {"train": None, "dev": None}
 
@@ -654,13 +883,13 @@ def main():
         sampler["train"] = DistributedSampler(
             dataset=dataset["train"],
             num_replicas=args.world_size,
-            rank=args.rank,
+            rank=torch.distributed.get_rank(),
             shuffle=True,
         )
         sampler["dev"] = DistributedSampler(
             dataset=dataset["dev"],
             num_replicas=args.world_size,
-            rank=args.rank,
+            rank=torch.distributed.get_rank(),
             shuffle=False,
         )
     data_loader = {
@@ -790,15 +1019,34 @@ def main():
             **config["embed_discriminator_scheduler_params"],
         ),
     }
+    # load teacher for distillation
+    teacher = None
+    if config.get("teacher_checkpoint", None) is not None:
+        teacher_config = None
+        if config.get("teacher_config", None) is not None:
+            with open(config["teacher_config"]) as f:
+                teacher_config = yaml.load(f, Loader=yaml.Loader)
+        teacher = load_model(config["teacher_checkpoint"], teacher_config).to(device).eval()
+        for param in teacher.parameters():
+            param.requires_grad = False
+        assert teacher.upsample_factor == model["generator"].upsample_factor and \
+            teacher.aux_context_window == model["generator"].aux_context_window, \
+            "Teacher and student must share the upsampling factor and the context window."
+        logging.info(f"Successfully load teacher parameters from {config['teacher_checkpoint']}.")
+
     if args.distributed:
         # wrap model for distributed training
-        try:
-            from apex.parallel import DistributedDataParallel
-        except ImportError:
-            raise ImportError("apex is not installed. please check https://github.com/NVIDIA/apex.")
-        model["generator"] = DistributedDataParallel(model["generator"])
-        model["discriminator"] = DistributedDataParallel(model["discriminator"])
-        model["embed_discriminator"] = DistributedDataParallel(model["embed_discriminator"])
+        from torch.nn.parallel import DistributedDataParallel
+        device_ids = [args.rank] if device.type == "cuda" else None
+        for key in ["generator", "discriminator", "embed_discriminator"]:
+            model[key] = DistributedDataParallel(
+                model[key],
+                device_ids=device_ids,
+                output_device=args.rank if device_ids is not None else None,
+                # NOTE: conv1x1_out of the last residual block of the generator gets no gradient
+                #   since only the skip outputs are used
+                find_unused_parameters=key == "generator",
+            )
     logging.info(model["generator"])
     logging.info(model["discriminator"])
     logging.info(model["embed_discriminator"])
@@ -823,6 +1071,7 @@ def main():
         scheduler=scheduler,
         config=config,
         device=device,
+        teacher=teacher,
     )
 
     # load pretrained parameters from checkpoint
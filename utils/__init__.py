@@ -1 +1,7 @@
 from .utils import *  # NOQA
+from .chunk_planner import *  # NOQA
+from .inference_cache import *  # NOQA
+from .noise import *  # NOQA
+from .pruning import *  # NOQA
+from .quantization import *  # NOQA
+from .singer_registry import *  # NOQA
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+"""Receptive field aware planner of chunk-wise inference."""
+
+import logging
+
+import torch
+
+
+def _ceil_div(x, y):
+    return -(-x // y)
+
+
+def _get_conv_context(conv, axis=-1):
+    """Return the number of past and future input samples read by each output of conv layer.
+
+    It also holds for the causal convs which pad both sides and drop the future outputs.
+
+    """
+    kernel_size, dilation, padding = conv.kernel_size[axis], conv.dilation[axis], conv.padding[axis]
+    return padding, (kernel_size - 1) * dilation - padding
+
+
+def get_context_size(model):
+    """Get the exact context needed to vocode a chunk of frames by Generator1.
+
+    The context is traced back from the output through the output convs,
+    the PQMF synthesis filter, the residual blocks at subband rate, and then
+    through the PQMF analysis filter for the noise and through the upsampling
+    network for the features. The chunks are assumed to start and end at
+    frame boundaries, and the context frames are counted on the outputs of
+    the conv_in layer, i.e., each chunk of features also has
+    ``aux_context_window`` frames on each side as in ``inference``.
+
+    Args:
+        model (Generator1): Generator.
+
+    Returns:
+        dict: Pairs of the past and future context of each part,
+            "output" (samples), "pqmf" (samples), "residual" (subband samples),
+            "noise" (samples), "upsample" (frames) and "frames" (frames) for the whole generator.
+
+    """
+    # lazy load for circular error
+    from layers import upsample
+
+    upsample_net = model.upsample_net
+    if isinstance(upsample_net, upsample.ConvInUpsampleNetwork):
+        upsample_net = upsample_net.upsample
+    assert isinstance(upsample_net, upsample.UpsampleNetwork), \
+        "Context size is not supported for this upsampling network."
+    subbands = model.pqmf.subbands
+    hop_size = int(model.upsample_factor * subbands)
+    taps = model.pqmf.analysis_filter.size(-1)
+    pqmf_context = (taps // 2, taps - 1 - taps // 2)
+    context = {"pqmf": pqmf_context}
+
+    # output convs at full rate
+    left, right = 0, 0
+    for conv in [model.pqmf_conv1, model.pqmf_conv2]:
+        past, future = _get_conv_context(conv)
+        left, right = left + past, right + future
+    context["output"] = (left, right)
+
+    # synthesis filter, then only every subbands-th sample comes from the subband signals
+    left, right = (left + pqmf_context[0]) // subbands, _ceil_div(right + pqmf_context[1], subbands)
+
+    # residual blocks at subband rate (the features are only read at the output time steps)
+    aux_left, aux_right = left, right
+    residual_left, residual_right = 0, 0
+    for f in reversed(model.conv_layers):
+        aux_left, aux_right = left + residual_left, right + residual_right
+        past, future = _get_conv_context(f.conv)
+        residual_left, residual_right = residual_left + past, residual_right + future
+    context["residual"] = (residual_left, residual_right)
+    left, right = left + residual_left, right + residual_right
+
+    # every subbands-th sample of the analysis filter output is kept
+    noise_left = left * subbands + pqmf_context[0]
+    noise_right = max((right - 1) * subbands + 1 + pqmf_context[1], 0)
+    context["noise"] = (noise_left, noise_right)
+
+    # upsampling network from the outputs of the conv_in layer to subband rate
+    for f in reversed(upsample_net.up_layers):
+        if isinstance(f, torch.nn.Conv2d):
+            past, future = _get_conv_context(f)
+            aux_left, aux_right = aux_left + past, aux_right + future
+        elif isinstance(f, upsample.Stretch2d):
+            aux_left, aux_right = _ceil_div(aux_left, f.x_scale), _ceil_div(aux_right, f.x_scale)
+    context["upsample"] = (aux_left, aux_right)
+
+    context["frames"] = (max(_ceil_div(noise_left, hop_size), aux_left),
+                         max(_ceil_div(noise_right, hop_size), aux_right))
+    return context
+
+
+def get_activation_bytes_per_frame(model, element_size=None):
+    """Estimate the peak activation memory of Generator1 without autograd per frame.
+
+    The peak is reached either in the residual blocks at subband rate, where
+    the upsampled features, the residual and skip signals and the temporary
+    outputs of a block are alive together, or in the output convs at full rate.
+    The conditioning of the residual blocks depends on the options of the
+    generator: the fused residual stack keeps the projected conditioning of
+    all blocks at subband rate, and the projection before upsampling keeps
+    that of all blocks at frame rate and upsamples one block at a time.
+
+    Args:
+        model (Generator1): Generator.
+        element_size (int): Number of bytes of each element in the residual blocks.
+            If not provided, it is taken from the precision of the residual blocks.
+            The other layers always run in float32.
+
+    Returns:
+        int: Number of bytes per frame.
+
+    """
+    if element_size is None:
+        element_size = torch.tensor([], dtype=model.residual_dtype).element_size()
+    # bytes of the conditioning cast from float32 to the precision of the residual blocks
+    cast_size = element_size if model.residual_dtype != torch.float32 else 0
+    num_layers = len(model.conv_layers)
+    gate_channels = max([f.conv.out_channels for f in model.conv_layers])
+    residual_channels = model.first_conv.out_channels
+    skip_channels = model.conv_layers[0].conv1x1_skip.out_channels
+
+    if model.project_aux_before_upsample:
+        # projected conditioning of all blocks at frame rate, and that of a block
+        # upsampled in float32 (the output and the stretched input of the last conv)
+        frame_memory = 4 * num_layers * gate_channels
+        aux_memory = model.upsample_factor * gate_channels * (2 * 4 + cast_size)
+    else:
+        frame_memory = 0
+        aux_memory = model.upsample_factor * model.aux_channels * (4 + cast_size)
+        if model.use_fused_residual_stack:
+            aux_memory += model.upsample_factor * num_layers * gate_channels * element_size
+    residual_memory = frame_memory + aux_memory + model.upsample_factor * element_size * (
+        3 * residual_channels + 2 * skip_channels + 3 * gate_channels)
+    output_memory = 4 * model.upsample_factor * model.pqmf.subbands * (
+        model.pqmf_conv1.out_channels + 2 * model.pqmf_conv1.in_channels)
+    return int(max(residual_memory, output_memory))
+
+
+def plan_chunks(model, memory_budget, num_frames=None, element_size=None):
+    """Plan the cheapest exact chunk-wise inference within the memory budget.
+
+    Each chunk is vocoded together with the context frames of both sides,
+    so the largest chunk within the memory budget has the least overhead.
+
+    Args:
+        model (Generator1): Generator.
+        memory_budget (int): Number of bytes available for the activations.
+        num_frames (int): Number of frames of the utterance. If the whole utterance
+            fits in the budget, it is planned as a single chunk without context.
+        element_size (int): Number of bytes of each element in the residual blocks.
+            If not provided, it is taken from the precision of the residual blocks.
+
+    Returns:
+        dict: Plan with "chunk_size", "left_context" and "right_context" in frames
+            and "overhead", the ratio of the vocoded frames to the output frames.
+
+    """
+    left, right = get_context_size(model)["frames"]
+    max_frames = memory_budget // get_activation_bytes_per_frame(model, element_size)
+    if num_frames is not None and num_frames <= max_frames:
+        return {"chunk_size": num_frames, "left_context": 0, "right_context": 0, "overhead": 1.0}
+    chunk_size = max_frames - left - right
+    if chunk_size <= 0:
+        raise ValueError(f"Memory budget is too small to vocode even a single frame "
+                         f"with {left} + {right} context frames ({memory_budget} bytes).")
+    plan = {
+        "chunk_size": int(chunk_size),
+        "left_context": left,
+        "right_context": right,
+        "overhead": (chunk_size + left + right) / chunk_size,
+    }
+    logging.debug(f"Planned chunk-wise inference: {plan}.")
+    return plan
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+"""Content addressed cache of generated waveforms."""
+
+import glob
+import hashlib
+import logging
+import os
+import threading
+
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+
+def get_checkpoint_id(checkpoint, *variants):
+    """Get identifier of the generator from the content of the checkpoint.
+
+    Args:
+        checkpoint (str): Checkpoint filename.
+        variants (str): Other settings changing the output (e.g. precision).
+
+    Returns:
+        str: Identifier of the generator.
+
+    """
+    h = hashlib.sha256()
+    with open(checkpoint, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return "-".join([h.hexdigest()] + [str(variant) for variant in variants])
+
+
+class InferenceCache(object):
+    """Cache of generated waveforms keyed by the hash of the features, generator and seed.
+
+    The waveforms are kept as npy files in the cache directory whose total size
+    is bounded, and the least recently used ones are removed first. The
+    modification time of the files keeps the order of use across processes
+    and restarts. The recently used waveforms are also kept in memory.
+
+    """
+
+    def __init__(self, cache_dir, max_bytes=1 << 30, memory_size=16):
+        """Initialize cache.
+
+        Args:
+            cache_dir (str): Directory to save the cached waveforms.
+            max_bytes (int): Maximum total size of the cached files in bytes.
+            memory_size (int): Maximum number of waveforms cached in memory.
+
+        """
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memory_size = memory_size
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+
+        # restore the order of use from the previous runs
+        self.index = OrderedDict()
+        self.total_bytes = 0
+        paths = sorted(glob.glob(os.path.join(cache_dir, "*.npy")), key=os.path.getmtime)
+        for path in paths:
+            key = os.path.splitext(os.path.basename(path))[0]
+            self.index[key] = os.path.getsize(path)
+            self.total_bytes += self.index[key]
+        logging.info(f"Found {len(self.index)} cached waveforms ({self.total_bytes / 2 ** 20:.1f} MB) in {cache_dir}.")
+
+    @staticmethod
+    def make_key(c, model_id, seed):
+        """Make cache key.
+
+        Args:
+            c (Union[Tensor, ndarray]): Local conditioning auxiliary features (T', C).
+            model_id (str): Identifier of the generator (see get_checkpoint_id).
+            seed (int): Seed of the input noise.
+
+        Returns:
+            str: Cache key.
+
+        """
+        if isinstance(c, torch.Tensor):
+            c = c.cpu().numpy()
+        c = np.ascontiguousarray(c, dtype=np.float32)
+        h = hashlib.sha256()
+        h.update(f"{c.shape}-{model_id}-{seed}".encode())
+        h.update(c.tobytes())
+        return h.hexdigest()
+
+    def get(self, key):
+        """Get cached waveform.
+
+        Args:
+            key (str): Cache key.
+
+        Returns:
+            ndarray: Cached waveform (T,), or None if not cached.
+
+        """
+        with self.lock:
+            y = self.memory.get(key)
+            if y is not None:
+                self.memory.move_to_end(key)
+            if key in self.index:
+                self.index.move_to_end(key)
+            elif y is None:
+                return None
+        path = self._get_path(key)
+        try:
+            if y is None:
+                y = np.load(path)
+                self._add_to_memory(key, y)
+            os.utime(path)
+        except (OSError, ValueError):
+            # removed by another process
+            with self.lock:
+                if key in self.index:
+                    self.total_bytes -= self.index.pop(key)
+        return y
+
+    def put(self, key, y):
+        """Add generated waveform to the cache.
+
+        Args:
+            key (str): Cache key.
+            y (Union[Tensor, ndarray]): Generated waveform.
+
+        """
+        if isinstance(y, torch.Tensor):
+            y = y.detach().cpu().numpy()
+        y = np.asarray(y, dtype=np.float32).reshape(-1)
+        self._add_to_memory(key, y)
+
+        # write to a temporary file first not to leave a broken file
+        path = self._get_path(key)
+        tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, y)
+        os.replace(tmp_path, path)
+
+        # remove the least recently used files
+        with self.lock:
+            self.total_bytes += os.path.getsize(path) - self.index.pop(key, 0)
+            self.index[key] = os.path.getsize(path)
+            removed = []
+            while self.total_bytes > self.max_bytes and len(self.index) > 1:
+                old_key, size = self.index.popitem(last=False)
+                self.total_bytes -= size
+                self.memory.pop(old_key, None)
+                removed.append(old_key)
+        for old_key in removed:
+            try:
+                os.remove(self._get_path(old_key))
+            except FileNotFoundError:
+                pass
+        if len(removed) != 0:
+            logging.debug(f"Removed {len(removed)} least recently used waveforms from the cache.")
+
+    def _add_to_memory(self, key, y):
+        if self.memory_size <= 0:
+            return
+        with self.lock:
+            self.memory[key] = y
+            self.memory.move_to_end(key)
+            if len(self.memory) > self.memory_size:
+                self.memory.popitem(last=False)
+
+    def _get_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npy")
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+"""Reproducible input noise."""
+
+import hashlib
+import logging
+
+import torch
+
+
+class NoiseProvider(object):
+    """Provider of reproducible input noise of the generator.
+
+    A single buffer of gaussian noise is sampled from the seed and kept on
+    each device, and the noise of an utterance is a view of the buffer
+    starting at an offset derived from the utterance id. So the same
+    utterance always gets the same noise on any device and no noise is
+    sampled or allocated for each utterance.
+
+    """
+
+    def __init__(self, seed=1, buffer_size=1 << 24):
+        """Initialize noise provider.
+
+        Args:
+            seed (int): Seed of the noise buffer.
+            buffer_size (int): Number of samples of the noise buffer. The noise longer
+                than the buffer is sampled for each call.
+
+        """
+        self.seed = seed
+        self.buffer_size = buffer_size
+        self.buffers = {}
+
+    def get(self, length, utt_id=None, device=torch.device("cpu")):
+        """Get input noise.
+
+        Args:
+            length (int): Number of samples.
+            utt_id (str): Utterance id. If not provided, the noise only depends on the seed.
+            device (torch.device): Device of the noise.
+
+        Returns:
+            Tensor: Input noise signal (length, 1).
+
+        """
+        device = torch.device(device)
+        offset = self._get_offset(utt_id)
+        if length > self.buffer_size:
+            logging.debug(f"Noise of {length} samples is longer than the buffer and sampled.")
+            generator = torch.Generator().manual_seed(self.seed + offset)
+            return torch.randn(length, 1, generator=generator).to(device)
+        if device not in self.buffers:
+            generator = torch.Generator().manual_seed(self.seed)
+            self.buffers[device] = torch.randn(self.buffer_size, generator=generator).to(device)
+        offset %= self.buffer_size - length + 1
+        return self.buffers[device][offset:offset + length].view(-1, 1)
+
+    def _get_offset(self, utt_id):
+        if utt_id is None:
+            return 0
+        digest = hashlib.sha256(f"{self.seed}-{utt_id}".encode()).digest()
+        return int.from_bytes(digest[:4], "little")
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+"""Structured pruning utility functions."""
+
+import logging
+
+import torch
+
+
+def get_pruning_sparsity(steps, target_sparsity, start_steps, end_steps):
+    """Get sparsity of the gradual pruning schedule.
+
+    The sparsity increases from 0 to the target with the cubic schedule in
+    `To prune, or not to prune`_, i.e., fast at first and slowly at last.
+
+    .. _`To prune, or not to prune`: https://arxiv.org/abs/1710.01878
+
+    Args:
+        steps (int): Current training steps.
+        target_sparsity (float): Final ratio of pruned gate channels.
+        start_steps (int): Training steps to start pruning.
+        end_steps (int): Training steps to reach the target sparsity.
+
+    Returns:
+        float: Ratio of gate channels to be pruned.
+
+    """
+    if steps < start_steps:
+        return 0.0
+    progress = min((steps - start_steps) / max(end_steps - start_steps, 1), 1.0)
+    return target_sparsity * (1.0 - (1.0 - progress) ** 3)
+
+
+@torch.no_grad()
+def get_gate_channel_importance(block):
+    """Get importance of each gate channel of the residual block.
+
+    A gate channel is a pair of the tanh and sigmoid outputs of the dilated
+    conv which are multiplied together. Its importance is the magnitude of
+    the tanh filter times the magnitude of the output weights reading it.
+
+    Args:
+        block (ResidualBlock): Residual block.
+
+    Returns:
+        Tensor: Importance of each gate channel (gate_channels // 2,).
+
+    """
+    # lazy load to keep the exported backends free from models and layers
+    from layers.residual_block import _get_conv_weight
+
+    num_channels = block.conv1x1_out.in_channels
+    conv_norm = _get_conv_weight(block.conv).norm(2, dim=(1, 2))
+    out_norm = _get_conv_weight(block.conv1x1_out).norm(2, dim=(0, 2)) + \
+        _get_conv_weight(block.conv1x1_skip).norm(2, dim=(0, 2))
+    return conv_norm[:num_channels] * out_norm
+
+
+@torch.no_grad()
+def update_gate_masks(blocks, sparsity):
+    """Update the masks of the gate channels by magnitude.
+
+    The same ratio of channels is pruned in every block. Pruned channels
+    are never restored, since they receive no gradient.
+
+    Args:
+        blocks (ModuleList): List of ResidualBlock modules.
+        sparsity (float): Ratio of gate channels to be pruned.
+
+    Returns:
+        list: Number of the remaining gate channels of each block.
+
+    """
+    num_remains = []
+    for f in blocks:
+        importance = get_gate_channel_importance(f)
+        if f.gate_mask is not None:
+            importance[f.gate_mask == 0] = -float("inf")
+        num_channels = len(importance)
+        num_keep = max(num_channels - int(round(sparsity * num_channels)), 1)
+        mask = torch.zeros_like(importance)
+        mask[importance.topk(num_keep).indices] = 1.0
+        f.gate_mask = mask
+        num_remains.append(num_keep)
+    return num_remains
+
+
+@torch.no_grad()
+def shrink_residual_blocks(blocks):
+    """Remove the pruned gate channels from the conv weights of the residual blocks.
+
+    Args:
+        blocks (ModuleList): List of ResidualBlock modules with weight norm removed.
+
+    Returns:
+        list: Number of the gate channels (gated conv outputs) of each block.
+
+    """
+    gate_channels = []
+    for f in blocks:
+        assert not hasattr(f.conv, "weight_g"), "Please remove weight norm before shrinking."
+        num_channels = f.conv1x1_out.in_channels
+        if f.gate_mask is not None:
+            idxs = f.gate_mask.nonzero().view(-1)
+        else:
+            idxs = torch.arange(num_channels, device=f.conv.weight.device)
+        gate_idxs = torch.cat([idxs, idxs + num_channels])
+
+        # dilated conv and local conditioning conv keep the selected tanh and sigmoid outputs
+        conv = torch.nn.Conv1d(f.conv.in_channels, len(gate_idxs), f.conv.kernel_size,
+                               padding=f.conv.padding, dilation=f.conv.dilation,
+                               bias=f.conv.bias is not None).to(f.conv.weight.device)
+        conv.weight.copy_(f.conv.weight[gate_idxs])
+        if f.conv.bias is not None:
+            conv.bias.copy_(f.conv.bias[gate_idxs])
+        f.conv = conv
+        if f.conv1x1_aux is not None:
+            conv1x1_aux = torch.nn.Conv1d(f.conv1x1_aux.in_channels, len(gate_idxs), 1,
+                                          bias=False).to(f.conv.weight.device)
+            conv1x1_aux.weight.copy_(f.conv1x1_aux.weight[gate_idxs])
+            f.conv1x1_aux = conv1x1_aux
+
+        # output convs read only the selected channels
+        for name in ["conv1x1_out", "conv1x1_skip"]:
+            old = getattr(f, name)
+            new = torch.nn.Conv1d(len(idxs), old.out_channels, 1,
+                                  bias=old.bias is not None).to(old.weight.device)
+            new.weight.copy_(old.weight[:, idxs])
+            if old.bias is not None:
+                new.bias.copy_(old.bias)
+            setattr(f, name, new)
+        f.gate_mask = None
+        gate_channels.append(len(gate_idxs))
+    logging.info(f"Gate channels of each block = {gate_channels}.")
+    return gate_channels
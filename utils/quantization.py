@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+"""Post-training quantization utility functions."""
+
+import logging
+
+import torch
+
+
+def _to_plain_conv1d(conv):
+    """Rebuild conv layer as torch.nn.Conv1d sharing the parameters.
+
+    The convs of the generator are subclasses of torch.nn.Conv1d, which are
+    not swapped by ``torch.quantization.convert`` since it matches the exact types.
+
+    """
+    plain = torch.nn.Conv1d(conv.in_channels, conv.out_channels, conv.kernel_size,
+                            stride=conv.stride, padding=conv.padding, dilation=conv.dilation,
+                            groups=conv.groups, bias=conv.bias is not None,
+                            padding_mode=conv.padding_mode)
+    plain.weight = conv.weight
+    plain.bias = conv.bias
+    return plain
+
+
+def quantize_generator(model, calibration_features, backend="fbgemm"):
+    """Quantize the convolution layers of the generator to int8.
+
+    Each ``torch.nn.Conv1d`` (the 1x1 convs, the dilated convs, the pre-conv
+    of the upsampling network and the output convs) is wrapped with quantize
+    and dequantize stubs, the activation ranges are calibrated by running
+    the generator over the given features and the convs are then replaced
+    with their int8 counterparts. The other operations, including the fixed
+    PQMF filters, stay in float32.
+
+    Args:
+        model (torch.nn.Module): Generator with weight norm removed.
+        calibration_features (list): List of features (T', C) for calibration.
+        backend (str): Quantized engine ("fbgemm" for x86 or "qnnpack" for ARM).
+
+    Returns:
+        torch.nn.Module: Quantized generator (quantized in-place).
+
+    """
+    assert not getattr(model, "use_fused_residual_stack", False), \
+        "Fused residual stack uses the conv weights directly and cannot be quantized."
+    assert not getattr(model, "project_aux_before_upsample", False), \
+        "Projection before upsampling uses the conv weights directly and cannot be quantized."
+    assert len(calibration_features) != 0, "At least one utterance is needed for calibration."
+    torch.backends.quantized.engine = backend
+    qconfig = torch.quantization.get_default_qconfig(backend)
+
+    # wrap convs to quantize the inputs and dequantize the outputs
+    wrappers = []
+    for module in list(model.modules()):
+        for name, child in list(module.named_children()):
+            if isinstance(child, torch.nn.Conv1d):
+                assert not hasattr(child, "weight_g"), "Please remove weight norm before quantization."
+                wrapper = torch.quantization.QuantWrapper(_to_plain_conv1d(child))
+                wrapper.qconfig = qconfig
+                setattr(module, name, wrapper)
+                wrappers.append(wrapper)
+    logging.info(f"{len(wrappers)} conv layers will be quantized with {backend} backend.")
+
+    # calibrate activation ranges
+    model = model.eval()
+    torch.quantization.prepare(model, inplace=True)
+    with torch.no_grad():
+        for c in calibration_features:
+            model.inference(c)
+    torch.quantization.convert(model, inplace=True)
+
+    # check that all the wrapped convs run in int8
+    assert all([isinstance(wrapper.module, torch.nn.quantized.Conv1d) for wrapper in wrappers]), \
+        "Some conv layers are not converted to int8."
+    is_quantized = []
+    hooks = [wrapper.module.register_forward_hook(
+        lambda module, inputs, output: is_quantized.append(output.is_quantized))
+        for wrapper in wrappers]
+    with torch.no_grad():
+        model.inference(calibration_features[0])
+    for hook in hooks:
+        hook.remove()
+    assert len(is_quantized) != 0 and all(is_quantized), "Some conv layers do not output int8 tensors."
+
+    return model
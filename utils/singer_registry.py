@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+"""Singer embedding registry."""
+
+import logging
+import os
+
+from collections import OrderedDict
+
+import h5py
+import numpy as np
+
+
+def get_singer_id(utt_id, delimiter="_"):
+    """Get singer id from utterance id.
+
+    Args:
+        utt_id (str): Utterance id whose prefix is the singer id (e.g. "singer01_0001").
+        delimiter (str): Delimiter between the singer id and the rest.
+
+    Returns:
+        str: Singer id.
+
+    """
+    return utt_id.split(delimiter)[0]
+
+
+class SingerEmbeddingRegistry(object):
+    """Registry of the centroid embeddings of singers.
+
+    The mean of the utterance embeddings and the number of utterances of each
+    singer are kept in a hdf5 file as ``{singer_id}/mean`` and ``{singer_id}/count``.
+    The centroids (L2 normalized means) of the recently used singers are cached
+    in memory, so that each lookup does not touch the disk.
+
+    """
+
+    def __init__(self, path, cache_size=128):
+        """Initialize registry.
+
+        Args:
+            path (str): Filename of the hdf5 index. It is created by the first ``add``.
+            cache_size (int): Maximum number of centroids cached in memory.
+
+        """
+        self.path = path
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def get(self, singer_id):
+        """Get centroid embedding of the singer.
+
+        Args:
+            singer_id (str): Singer id.
+
+        Returns:
+            ndarray: Centroid embedding (D,).
+
+        """
+        if singer_id in self.cache:
+            self.cache.move_to_end(singer_id)
+            return self.cache[singer_id]
+
+        if not os.path.exists(self.path):
+            raise KeyError(f"Singer embedding registry does not exist ({self.path}).")
+        with h5py.File(self.path, "r") as f:
+            if singer_id not in f:
+                raise KeyError(f"There is no such a singer in the registry ({singer_id}).")
+            mean = f[singer_id]["mean"][()]
+        centroid = (mean / max(np.linalg.norm(mean), 1e-8)).astype(np.float32)
+
+        self.cache[singer_id] = centroid
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return centroid
+
+    def add(self, singer_id, embeds):
+        """Add utterance embeddings of the singer to the registry.
+
+        Args:
+            singer_id (str): Singer id.
+            embeds (ndarray): Utterance embeddings (N, D).
+
+        """
+        embeds = np.asarray(embeds, dtype=np.float64).reshape(len(embeds), -1)
+        with h5py.File(self.path, "a") as f:
+            if singer_id in f:
+                count = int(f[singer_id]["count"][()])
+                mean = f[singer_id]["mean"][()]
+                del f[singer_id]
+            else:
+                count, mean = 0, np.zeros(embeds.shape[1])
+            mean = (mean * count + embeds.sum(0)) / (count + len(embeds))
+            f.create_dataset(f"{singer_id}/mean", data=mean)
+            f.create_dataset(f"{singer_id}/count", data=count + len(embeds))
+        self.cache.pop(singer_id, None)
+
+    def singer_ids(self):
+        """Return the list of registered singer ids."""
+        if not os.path.exists(self.path):
+            return []
+        with h5py.File(self.path, "r") as f:
+            return list(f.keys())
+
+    def __contains__(self, singer_id):
+        """Return whether the singer is registered."""
+        return singer_id in self.cache or singer_id in self.singer_ids()
+
+
+def build_singer_registry(files, path, delimiter="_", embed_path="embed"):
+    """Build singer embedding registry from dumped hdf5 files.
+
+    Args:
+        files (list): List of hdf5 filenames including utterance embeddings.
+        path (str): Filename of the hdf5 index to be written.
+        delimiter (str): Delimiter between the singer id and the rest of the utterance id.
+        embed_path (str): Dataset name of the embedding in the hdf5 files.
+
+    Returns:
+        SingerEmbeddingRegistry: Built registry.
+
+    """
+    embeds = {}
+    for filename in files:
+        utt_id = os.path.splitext(os.path.basename(filename))[0]
+        with h5py.File(filename, "r") as f:
+            embeds.setdefault(get_singer_id(utt_id, delimiter), []).append(f[embed_path][()])
+
+    registry = SingerEmbeddingRegistry(path)
+    for singer_id, singer_embeds in embeds.items():
+        registry.add(singer_id, np.stack(singer_embeds))
+    logging.info(f"Registered {len(embeds)} singers ({len(files)} utterances) to {path}.")
+    return registry
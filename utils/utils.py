@@ -16,7 +16,6 @@ from distutils.version import LooseVersion
 import h5py
 import numpy as np
 import torch
-import yaml
 
 PRETRAINED_MODEL_LIST = {
     "ljspeech_parallel_wavegan.v1": "1PdZv37JhAQH6AwNh31QlqruqrvjTBq7U",
@@ -281,6 +280,9 @@ def load_model(checkpoint, config=None):
     """
     # load config if not provided
     if config is None:
+        # lazy load to keep exported models free from yaml
+        import yaml
+
         dirname = os.path.dirname(checkpoint)
         config = os.path.join(dirname, "config.yml")
         with open(config) as f: